@@ -1,14 +1,37 @@
 import os
+import re
+import csv
+import copy
+import gzip
+import json
+import hmac
+import signal
+import socket
+import multiprocessing
 import logging
 import sqlite3
+import time
 import datetime
 import asyncio
-from aiogram import Bot, Dispatcher, types, F
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from collections import OrderedDict, Counter
+from aiohttp import web
+from aiogram import Bot, Dispatcher, BaseMiddleware, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
 from aiogram.filters import Command, CommandStart, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton, 
-                           InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, FSInputFile)
+                           InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, FSInputFile,
+                           InlineQueryResultArticle, InputTextMessageContent)
 
 # --- KONFIGURATSIYA ---
 # API_TOKEN = os.getenv("BOT_TOKEN")
@@ -32,90 +55,755 @@ CARD_UZS = os.getenv("CARD_UZS", "5614686817322558")
 CARD_NAME = os.getenv("CARD_NAME", "Sayfullayev Sherali")
 CARD_VISA = os.getenv("CARD_VISA", "4176550026725055")
 
+# Ishga tushirish rejimi: polling yoki webhook (webhookda WEB_WORKERS ta jarayon bitta bazada ishlaydi)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+MULTI_PROCESS = BOT_MODE == "webhook" and WEB_WORKERS > 1
+
+# Lokal Bot API server yoki emulator.py uchun (masalan http://127.0.0.1:8081). Bo'sh bo'lsa - api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
 logging.basicConfig(level=logging.INFO)
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None)
+
+# --- METRIKALAR ---
+# Handler, baza va Telegram API vaqtlari jarayon xotirasida yig'iladi va Prometheus matn formatida
+# METRICS_PORT (faqat 127.0.0.1) orqali beriladi. Adminga /metrics buyrug'i qisqa xulosa ko'rsatadi.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # 0 - HTTP endpoint o'chirilgan
+
+class Metrics:
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {} # (nom, labellar) -> [bucket hisoblari..., +Inf], yig'indi, soni
+        self._counters = Counter()
+        self._help = {}
+
+    def describe(self, name, kind, text):
+        self._help[name] = (kind, text)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = hist[0]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[idx] += 1
+                break
+        else:
+            counts[-1] += 1
+        hist[1] += value
+        hist[2] += 1
+
+    def inc(self, name, amount=1, **labels):
+        self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def quantile(self, counts, total, q):
+        # Taxminiy qiymat: kerakli ulush tushgan bucketning yuqori chegarasi
+        rank, seen = q * total, 0
+        for idx, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def summary(self, name, label):
+        # [(label qiymati, soni, o'rtacha, p50, p99)] - eng ko'p vaqt olganlari birinchi
+        rows = []
+        for (hname, labels), (counts, total_sum, total) in self._histograms.items():
+            if hname != name or not total: continue
+            rows.append((dict(labels).get(label, ""), total, total_sum / total,
+                         self.quantile(counts, total, 0.5), self.quantile(counts, total, 0.99), total_sum))
+        rows.sort(key=lambda row: row[-1], reverse=True)
+        return [row[:-1] for row in rows]
+
+    def counter(self, name, **match):
+        return sum(value for (cname, labels), value in self._counters.items()
+                   if cname == name and all(dict(labels).get(k) == v for k, v in match.items()))
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs: return ""
+        escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines, seen = [], set()
+        def header(name, kind):
+            if name in seen: return
+            seen.add(name)
+            kind, text = self._help.get(name, (kind, ""))
+            if text: lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+        for (name, labels), value in sorted(self._counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), (counts, total_sum, total) in sorted(self._histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {total_sum:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("bot_handler_seconds", "histogram", "Handler bajarilish vaqti")
+metrics.describe("bot_handler_errors_total", "counter", "Handlerda ko'tarilgan xatoliklar")
+metrics.describe("bot_db_seconds", "histogram", "db_query so'rov vaqti")
+metrics.describe("bot_db_rows_total", "counter", "db_query qaytargan qatorlar")
+metrics.describe("bot_db_errors_total", "counter", "db_query xatoliklari")
+metrics.describe("bot_api_seconds", "histogram", "Telegram Bot API so'rov vaqti")
+metrics.describe("bot_api_errors_total", "counter", "Telegram Bot API xatoliklari")
+metrics.describe("bot_api_retry_after_total", "counter", "Telegram 429 (RetryAfter) javoblari")
+metrics.describe("bot_api_retry_after_seconds_total", "counter", "RetryAfter bo'yicha kutish talab qilingan vaqt")
+metrics.describe("bot_throttled_total", "counter", "Anti-spam tomonidan to'xtatilgan updatelar")
+metrics.describe("bot_outbox_enqueued_total", "counter", "Outbox ga yozilgan xabarlar")
+metrics.describe("bot_outbox_total", "counter", "Outbox yuborish natijalari (sent / deferred / retry / dead)")
+
+_STATEMENT_RE = re.compile(r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE)\s+(\w+))?", re.S | re.I)
+_statement_labels = {}
+
+def statement_label(query):
+    # "SELECT ... FROM users WHERE ..." -> "SELECT users" (labellar soni cheklangan bo'lishi uchun)
+    label = _statement_labels.get(query)
+    if label is None:
+        match = _STATEMENT_RE.match(query)
+        label = " ".join(filter(None, (match.group(1).upper(), match.group(2)))) if match else "?"
+        _statement_labels[query] = label
+    return label
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.inc("bot_handler_errors_total", handler=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - started, handler=name)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            metrics.inc("bot_api_retry_after_total", method=name)
+            metrics.inc("bot_api_retry_after_seconds_total", e.retry_after, method=name)
+            raise
+        except Exception as e:
+            metrics.inc("bot_api_errors_total", method=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", time.perf_counter() - started, method=name)
+
+bot.session.middleware(ApiMetricsMiddleware())
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_metrics_server(port):
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_endpoint)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, port).start()
+    logging.info(f"Metrikalar: http://{METRICS_HOST}:{port}/metrics")
+    return runner
 
 # --- BAZA BILAN ISHLASH ---
-def db_query(query, params=(), fetchone=False, fetchall=False, commit=False):
-    try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            if commit: conn.commit()
+class Database:
+    # Doimiy ulanishlar qatlami: bitta yozuvchi ulanish (WAL rejimida) va kichik o'quvchilar puli.
+    # Barcha so'rovlar thread executorda bajariladi, shuning uchun event loop bloklanmaydi.
+    # Yozuvlar tranzaksiya birliklari (unit of work) sifatida navbatga qo'yiladi: yozuvchi thread
+    # navbatdagi barcha birliklarni bitta BEGIN IMMEDIATE ichida (har biri o'z SAVEPOINT ida)
+    # bajarib, bitta commit qiladi (group commit) - o'nlab o'tkazma bitta fsync turadi.
+    def __init__(self, path, readers=4, group_commit_window=0.0):
+        self.path = path
+        self.group_commit_window = group_commit_window
+        self._writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._reader_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._tx_queue = []
+        self._tx_scheduled = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def _conn(self):
+        # Har bir thread o'z ulanishini qayta ishlatadi (yozuvchi thread bitta)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _read(self, query, params, fetchone, fetchall):
+        cursor = self._conn().execute(query, params)
+        try:
             if fetchone: return cursor.fetchone()
             if fetchall: return cursor.fetchall()
             return None
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _statement(conn, query, params, fetchone, fetchall):
+        cursor = conn.execute(query, params)
+        if fetchone: return cursor.fetchone()
+        if fetchall: return cursor.fetchall()
+        return None
+
+    @staticmethod
+    def _statements(conn, query, seq, returning):
+        if returning:
+            return [conn.execute(query, params).fetchone() for params in seq]
+        return conn.executemany(query, seq).rowcount
+
+    @staticmethod
+    def _settle(fut, result, error):
+        if fut.cancelled(): return
+        if error is not None: fut.set_exception(error)
+        else: fut.set_result(result)
+
+    def _drain_transactions(self):
+        if self.group_commit_window:
+            time.sleep(self.group_commit_window) # Yana birliklar yig'ilishi uchun qisqa oyna
+        with self._lock:
+            batch, self._tx_queue = self._tx_queue, []
+            self._tx_scheduled = False
+        if not batch: return
+        conn = self._conn()
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, args, fut, loop in batch:
+                conn.execute("SAVEPOINT unit")
+                try:
+                    result = fn(conn, *args)
+                    conn.execute("RELEASE unit")
+                    outcomes.append((fut, loop, result, None))
+                except Exception as e:
+                    # Faqat shu birlik bekor qilinadi, qolganlari commit bo'ladi
+                    conn.execute("ROLLBACK TO unit")
+                    conn.execute("RELEASE unit")
+                    outcomes.append((fut, loop, None, e))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction: conn.rollback()
+            outcomes = [(fut, loop, None, e) for _, _, fut, loop in batch]
+        for fut, loop, result, error in outcomes:
+            loop.call_soon_threadsafe(self._settle, fut, result, error)
+
+    async def transaction(self, fn, *args):
+        # fn(conn, *args) yozuvchi threadda bitta atomik birlik sifatida bajariladi.
+        # fn ichida ko'tarilgan xatolik faqat shu birlikni bekor qiladi va chaqiruvchiga qaytadi.
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        with self._lock:
+            self._tx_queue.append((fn, args, fut, loop))
+            schedule = not self._tx_scheduled
+            self._tx_scheduled = True
+        if schedule:
+            self._writer_pool.submit(self._drain_transactions)
+        return await fut
+
+    async def executemany(self, query, seq, returning=False):
+        # Bir nechta yozuvni bitta tranzaksiyada bajarish.
+        # returning=True bo'lsa har bir so'rovning RETURNING qatori ro'yxat qilib qaytariladi.
+        return await self.transaction(self._statements, query, list(seq), returning)
+
+    async def execute(self, query, params=(), fetchone=False, fetchall=False, commit=False):
+        if commit:
+            return await self.transaction(self._statement, query, params, fetchone, fetchall)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_pool, self._read, query, params, fetchone, fetchall)
+
+    def close(self):
+        self._writer_pool.shutdown(wait=True)
+        self._reader_pool.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+
+db = Database(DB_NAME, readers=int(os.getenv("DB_READERS", "4")),
+              group_commit_window=float(os.getenv("DB_GROUP_COMMIT_MS", "0")) / 1000)
+
+async def db_query(query, params=(), fetchone=False, fetchall=False, commit=False):
+    label = statement_label(query)
+    started = time.perf_counter()
+    try:
+        result = await db.execute(query, params, fetchone=fetchone, fetchall=fetchall, commit=commit)
     except Exception as e:
+        metrics.inc("bot_db_errors_total", statement=label)
         logging.error(f"Bazada xatolik: {e}")
         return None
+    finally:
+        metrics.observe("bot_db_seconds", time.perf_counter() - started, statement=label)
+    if fetchall: metrics.inc("bot_db_rows_total", len(result), statement=label)
+    elif fetchone and result is not None: metrics.inc("bot_db_rows_total", statement=label)
+    return result
+
+# --- SXEMA MIGRATSIYALARI ---
+# Bazaning sxema versiyasi PRAGMA user_version da saqlanadi. Har bir qadam o'z tranzaksiyasida bajariladi
+# va versiyani bittaga oshiradi. Sxemani o'zgartirish uchun MIGRATIONS oxiriga yangi qadam qo'shiladi,
+# mavjud qadamlar o'zgartirilmaydi. Yangilangan bazada ishga tushish bitta pragma o'qishidan iborat.
+
+def _add_column(conn, table, column, column_type):
+    # Migratsiyalardan oldingi bazalarda ustun allaqachon bo'lishi mumkin
+    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def _m001_base_tables(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users 
+                    (id INTEGER PRIMARY KEY, 
+                     balance REAL DEFAULT 0.0,
+                     status_level INTEGER DEFAULT 0,
+                     status_expire TEXT,
+                     referrer_id INTEGER,
+                     joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS config 
+                    (key TEXT PRIMARY KEY, value TEXT)''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS projects 
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                     name TEXT, 
+                     price REAL, 
+                     description TEXT,
+                     media_id TEXT,
+                     media_type TEXT,
+                     file_id TEXT,
+                     seller_id INTEGER DEFAULT NULL,
+                     is_approved INTEGER DEFAULT 1)''') # is_approved: 1=approved, 0=pending, -1=rejected
+                     
+    conn.execute('''CREATE TABLE IF NOT EXISTS uc_packages
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     uc_amount INTEGER,
+                     uzs_price REAL,
+                     usd_price REAL)''')
+
+    # Juda eski bazalarda yetishmaydigan ustunlar. SQLite to'ldirilgan jadvalga CURRENT_TIMESTAMP default
+    # bilan ustun qo'sha olmaydi, shuning uchun joined_at u yerda defaultsiz qo'shiladi.
+    for column, column_type in (("status_level", "INTEGER"), ("referrer_id", "INTEGER"), ("status_expire", "TEXT"),
+                                ("joined_at", "TIMESTAMP")):
+        _add_column(conn, "users", column, column_type)
+    for column, column_type in (("description", "TEXT"), ("media_id", "TEXT"), ("media_type", "TEXT"), ("file_id", "TEXT"),
+                                ("seller_id", "INTEGER DEFAULT NULL"), ("is_approved", "INTEGER DEFAULT 1")):
+        _add_column(conn, "projects", column, column_type)
+
+def _m002_broadcasts(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS broadcasts
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     from_chat_id INTEGER,
+                     message_id INTEGER,
+                     status TEXT DEFAULT 'running',
+                     last_user_id INTEGER DEFAULT 0,
+                     total INTEGER DEFAULT 0,
+                     sent INTEGER DEFAULT 0,
+                     failed INTEGER DEFAULT 0,
+                     blocked INTEGER DEFAULT 0,
+                     progress_chat_id INTEGER,
+                     progress_message_id INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''') # status: running / done
+    _add_column(conn, "users", "is_blocked", "INTEGER DEFAULT 0")
+
+def _m003_status_expire_at(conn):
+    _add_column(conn, "users", "status_expire_at", "INTEGER")
+    _add_column(conn, "users", "status_reminded", "INTEGER DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_status_expire_at ON users(status_expire_at)")
+    # Eski matnli status_expire qiymatlarini epoch (status_expire_at) ga ko'chirish
+    old_rows = conn.execute("SELECT id, status_expire FROM users WHERE status_expire IS NOT NULL").fetchall()
+    for uid, expire in old_rows:
+        expire_at = int(time.mktime(datetime.datetime.strptime(expire, "%Y-%m-%d %H:%M:%S").timetuple()))
+        conn.execute("UPDATE users SET status_expire_at = ?, status_expire = NULL WHERE id = ?", (expire_at, uid))
+
+def _m004_fsm_states(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS fsm_states
+                    (key TEXT PRIMARY KEY,
+                     state TEXT,
+                     data TEXT,
+                     updated_at INTEGER)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+def _m005_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_referrer_id ON users(referrer_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_projects_approved_id ON projects(is_approved, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_projects_seller_id ON projects(seller_id)")
+
+def _m006_orders(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     kind TEXT NOT NULL,
+                     user_id INTEGER NOT NULL,
+                     amount REAL,
+                     details TEXT,
+                     state TEXT NOT NULL DEFAULT 'pending',
+                     admin_chat_id INTEGER,
+                     admin_message_id INTEGER,
+                     created_at INTEGER NOT NULL,
+                     decided_at INTEGER)''') # kind: uc / topup / withdraw; state: pending / approved / rejected
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_state_created ON orders(state, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)")
+
+def _m007_notifications(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS notifications
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     chat_id INTEGER NOT NULL,
+                     text TEXT NOT NULL,
+                     parse_mode TEXT,
+                     state TEXT NOT NULL DEFAULT 'pending',
+                     attempts INTEGER DEFAULT 0,
+                     next_at REAL NOT NULL,
+                     last_error TEXT,
+                     created_at INTEGER NOT NULL)''') # state: pending / dead (yuborilganlari o'chiriladi)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_state_next ON notifications(state, next_at)")
+
+def _m008_referral_stats(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS referral_stats
+                    (user_id INTEGER PRIMARY KEY,
+                     level1 INTEGER DEFAULT 0,
+                     level2 INTEGER DEFAULT 0,
+                     level3 INTEGER DEFAULT 0,
+                     earned REAL DEFAULT 0.0)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_referral_stats_level1 ON referral_stats(level1 DESC)")
+    # Mavjud referrer_id lardan hisoblagichlarni tiklash. Avvalgi bonuslar yozib olinmagan, shuning uchun
+    # `earned` joriy ref_reward bo'yicha taxminan hisoblanadi.
+    parents = dict(conn.execute("SELECT id, referrer_id FROM users WHERE referrer_id IS NOT NULL"))
+    counts = {}
+    for uid in parents:
+        ancestor = uid
+        for level in range(3):
+            ancestor = parents.get(ancestor)
+            if ancestor is None: break
+            counts.setdefault(ancestor, [0, 0, 0])[level] += 1
+    row = conn.execute("SELECT value FROM config WHERE key = 'ref_reward'").fetchone()
+    reward = float(row[0]) if row else 1.0
+    conn.executemany("INSERT INTO referral_stats (user_id, level1, level2, level3, earned) "
+                     "SELECT id, ?, ?, ?, ? FROM users WHERE id = ?",
+                     [(l1, l2, l3, l1 * reward, uid) for uid, (l1, l2, l3) in counts.items()])
+
+def _m009_daily_stats(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS daily_stats
+                    (day TEXT,
+                     metric TEXT,
+                     events INTEGER DEFAULT 0,
+                     amount REAL DEFAULT 0.0,
+                     PRIMARY KEY (day, metric)) WITHOUT ROWID''')
+
+def _m010_projects_fts(conn):
+    # projects jadvalining nomi va tavsifi bo'yicha to'liq matnli indeks (external content).
+    # Triggerlar uni har bir INSERT/UPDATE/DELETE da yangilaydi.
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS projects_fts USING fts5(name, description, content='projects', "
+                 "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_ai AFTER INSERT ON projects BEGIN
+                        INSERT INTO projects_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_ad AFTER DELETE ON projects BEGIN
+                        INSERT INTO projects_fts (projects_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS projects_fts_au AFTER UPDATE OF name, description ON projects BEGIN
+                        INSERT INTO projects_fts (projects_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                        INSERT INTO projects_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+                    END''')
+    conn.execute("INSERT INTO projects_fts (projects_fts) VALUES ('rebuild')")
+
+def _m011_cache_versions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache_versions
+                    (name TEXT PRIMARY KEY,
+                     version INTEGER DEFAULT 0)''')
+
+def _m012_orders_admin_message(conn):
+    # Eski tugmali admin xabarlarini buyurtmaga bog'lash (Orders.adopt) uchun
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_admin_message ON orders(admin_chat_id, admin_message_id) "
+                 "WHERE admin_message_id IS NOT NULL")
+
+MIGRATIONS = (_m001_base_tables, _m002_broadcasts, _m003_status_expire_at, _m004_fsm_states, _m005_indexes,
+              _m006_orders, _m007_notifications, _m008_referral_stats, _m009_daily_stats, _m010_projects_fts,
+              _m011_cache_versions, _m012_orders_admin_message)
+
+def migrate_db(path=DB_NAME):
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            if version > len(MIGRATIONS):
+                logging.warning(f"Baza sxemasi ({version}) koddagidan ({len(MIGRATIONS)}) yangiroq")
+            return version
+        conn.execute("PRAGMA journal_mode=WAL")
+        while True:
+            # Versiya lock ostida qayta o'qiladi: bir nechta webhook worker bir vaqtda ishga tushishi mumkin
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    conn.execute("COMMIT")
+                    return version
+                step = MIGRATIONS[version]
+                started = time.perf_counter()
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logging.info(f"Migratsiya {version + 1} ({step.__name__}): {(time.perf_counter() - started) * 1000:.1f} ms")
+    finally:
+        conn.close()
+
+migrate_db()
+
+# --- FSM XOTIRASI (SQLITE + LRU) ---
+class SQLiteStorage(BaseStorage):
+    # FSM holatlari fsm_states jadvalida saqlanadi (restartdan keyin ham qoladi), oldida
+    # read-through LRU kesh turadi. Yozuvlar har `flush_interval` sekundda bitta tranzaksiyada
+    # yoziladi (0 - darhol), `ttl` sekund o'zgarmagan (tashlab ketilgan) holatlar o'chiriladi.
+    # Bir nechta jarayonda (MULTI_PROCESS) kesh o'chiriladi va yozuvlar darhol bajariladi: foydalanuvchining
+    # ketma-ket updatelari turli jarayonlarga tushadi.
+    def __init__(self, cache_size=10000, ttl=86400, flush_interval=1.0, sweep_interval=600):
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()
+        self._dirty = {}
+        self._inflight = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.business_connection_id or ''}:{key.destiny}"
+
+    def _remember(self, k, entry):
+        if not self.cache_size: return
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, k):
+        entry = self._dirty.get(k) or self._inflight.get(k)
+        if entry is None:
+            entry = self._cache.get(k)
+            if entry is not None: self._cache.move_to_end(k)
+        if entry is None:
+            row = await db_query("SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (k,), fetchone=True)
+            entry = (row[0], json.loads(row[1]) if row[1] else {}, row[2]) if row else (None, {}, 0)
+            self._remember(k, entry)
+        if entry[2] and entry[2] < time.time() - self.ttl:
+            return (None, {}, 0) # Muddati o'tgan holat bo'sh hisoblanadi
+        return entry
+
+    async def _store(self, k, state, data):
+        entry = (state, data, int(time.time()))
+        self._remember(k, entry)
+        if self.flush_interval > 0:
+            self._dirty[k] = entry
+        else:
+            await db.transaction(self._write, [(k, entry)])
 
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute('''CREATE TABLE IF NOT EXISTS users 
-                          (id INTEGER PRIMARY KEY, 
-                           balance REAL DEFAULT 0.0,
-                           status_level INTEGER DEFAULT 0,
-                           status_expire TEXT,
-                           referrer_id INTEGER,
-                           joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-
-        cursor.execute('''CREATE TABLE IF NOT EXISTS config 
-                          (key TEXT PRIMARY KEY, value TEXT)''')
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS projects 
-                          (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                           name TEXT, 
-                           price REAL, 
-                           description TEXT,
-                           media_id TEXT,
-                           media_type TEXT,
-                           file_id TEXT,
-                           seller_id INTEGER DEFAULT NULL,
-                           is_approved INTEGER DEFAULT 1)''') # is_approved: 1=approved, 0=pending, -1=rejected
-                           
-        cursor.execute('''CREATE TABLE IF NOT EXISTS uc_packages
-                          (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                           uc_amount INTEGER,
-                           uzs_price REAL,
-                           usd_price REAL)''')
-        conn.commit()
-    
-    # Migratsiyalar (avvalgidek qoldi + yangi ustunlar)
-    columns_users = ["status_level", "referrer_id", "joined_at", "status_expire"]
-    for col in columns_users:
-        try: 
-            if col == "status_level" or col == "referrer_id":
-                db_query(f"ALTER TABLE users ADD COLUMN {col} INTEGER", commit=True)
-            elif col == "status_expire":
-                 db_query(f"ALTER TABLE users ADD COLUMN {col} TEXT", commit=True)
-            elif col == "joined_at":
-                 db_query(f"ALTER TABLE users ADD COLUMN {col} TEXT DEFAULT CURRENT_TIMESTAMP", commit=True)
-        except: pass
-    
-    columns_projects = ["description", "media_id", "media_type", "file_id", "seller_id", "is_approved"]
-    for col in columns_projects:
-        try: 
-            if col == "seller_id":
-                db_query(f"ALTER TABLE projects ADD COLUMN {col} INTEGER DEFAULT NULL", commit=True)
-            elif col == "is_approved":
-                db_query(f"ALTER TABLE projects ADD COLUMN {col} INTEGER DEFAULT 1", commit=True)
+    @staticmethod
+    def _write(conn, entries):
+        for k, (state, data, updated_at) in entries:
+            if state is None and not data:
+                conn.execute("DELETE FROM fsm_states WHERE key = ?", (k,))
             else:
-                db_query(f"ALTER TABLE projects ADD COLUMN {col} TEXT", commit=True)
-        except: pass
-
-init_db()
+                conn.execute("INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                             "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                             (k, state, json.dumps(data, ensure_ascii=False), updated_at))
+
+    async def set_state(self, key, state=None):
+        k = self._key(key)
+        _, data, _ = await self._load(k)
+        await self._store(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        return (await self._load(self._key(key)))[0]
+
+    async def set_data(self, key, data):
+        k = self._key(key)
+        state, _, _ = await self._load(k)
+        await self._store(k, state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key):
+        return copy.deepcopy((await self._load(self._key(key)))[1])
+
+    async def flush(self):
+        async with self._lock:
+            if not self._dirty: return
+            self._inflight, self._dirty = self._dirty, {}
+            try:
+                await db.transaction(self._write, list(self._inflight.items()))
+            except Exception as e:
+                logging.error(f"FSM yozishda xatolik: {e}")
+                for k, entry in self._inflight.items():
+                    self._dirty.setdefault(k, entry)
+            finally:
+                self._inflight = {}
+
+    async def sweep(self):
+        expire_before = int(time.time() - self.ttl)
+        await db_query("DELETE FROM fsm_states WHERE updated_at < ?", (expire_before,), commit=True)
+        for k in [k for k, entry in self._cache.items() if entry[2] < expire_before]:
+            del self._cache[k]
+
+    async def _run(self):
+        last_sweep = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval or self.sweep_interval)
+            await self.flush()
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                try: await self.sweep()
+                except Exception as e: logging.error(f"FSM tozalashda xatolik: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
+
+fsm_storage = SQLiteStorage(cache_size=0 if MULTI_PROCESS else int(os.getenv("FSM_CACHE_SIZE", "10000")),
+                            ttl=int(os.getenv("FSM_TTL", "86400")),
+                            flush_interval=0 if MULTI_PROCESS else float(os.getenv("FSM_FLUSH_INTERVAL", "1")))
+dp = Dispatcher(storage=fsm_storage)
+
+# --- JARAYONLARARO KESH SINXRONIZATSIYASI ---
+# Bir nechta jarayonda (MULTI_PROCESS) har biri o'z keshlarini saqlaydi. Admin tahriri keshni
+# o'z jarayonida tozalaydi va cache_versions dagi qatorni oshiradi; boshqa jarayonlar har update
+# oldidan versiyalarni o'qiydi (bitta kichik so'rov) va o'zgarganlarini qayta yuklaydi.
+class CacheSync(BaseMiddleware):
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self._seen = {}
+        self._reloaders = {}
+        self._check = None
+        self._tasks = set()
+
+    def register(self, name, reload):
+        # reload() - keshni faqat shu jarayonda tozalaydi (oddiy yoki async funksiya)
+        self._reloaders[name] = reload
+
+    async def bump(self, name):
+        if not self.enabled: return
+        row = await db_query("INSERT INTO cache_versions (name, version) VALUES (?, 1) "
+                             "ON CONFLICT(name) DO UPDATE SET version = version + 1 RETURNING version",
+                             (name,), fetchone=True, commit=True)
+        self._seen[name] = max(self._seen.get(name, 0), row[0])
+
+    def notify(self, name):
+        # Sinxron invalidate() lardan chaqiriladi - versiya fonda oshiriladi
+        if not self.enabled: return
+        task = asyncio.create_task(self.bump(name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start(self):
+        # Joriy versiyalarni eslab qolish (startda keshlar baribir yangi yuklangan)
+        if not self.enabled: return
+        self._seen = dict(await db_query("SELECT name, version FROM cache_versions", fetchall=True) or [])
+
+    async def _refresh(self):
+        rows = await db_query("SELECT name, version FROM cache_versions", fetchall=True) or []
+        for name, version in rows:
+            if self._seen.get(name, 0) < version:
+                self._seen[name] = version
+                reload = self._reloaders.get(name)
+                if reload is None: continue
+                result = reload()
+                if asyncio.iscoroutine(result): await result
+
+    async def check(self):
+        # Bir vaqtda kelgan updatelar bitta tekshiruvni kutadi
+        if self._check is None or self._check.done():
+            self._check = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._check)
+
+    async def stop(self):
+        if self._tasks: await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def __call__(self, handler, event, data):
+        try: await self.check()
+        except Exception as e: logging.error(f"Kesh versiyalarini tekshirishda xatolik: {e}")
+        return await handler(event, data)
+
+cache_sync = CacheSync(MULTI_PROCESS)
+if MULTI_PROCESS: dp.update.outer_middleware(cache_sync)
 
 # --- SOZLAMALAR ---
+class ConfigCache:
+    # Jarayon ichidagi config keshi: startda bir marta yuklanadi, o'qishlar xotiradan,
+    # set_config esa bazaga yozib keshni yangilaydi (write-through). Har yozishda version oshadi.
+    def __init__(self):
+        self._values = {}
+        self._snapshots = {}
+        self.version = 0
+
+    async def load(self):
+        rows = await db_query("SELECT key, value FROM config", fetchall=True) or []
+        self._values = dict(rows)
+        self._snapshots.clear()
+        self.version += 1
+
+    def get(self, key, default_value):
+        return self._values.get(key, str(default_value))
+
+    async def set(self, key, value):
+        await db_query("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, str(value)), commit=True)
+        self._values[key] = str(value)
+        self._snapshots.clear()
+        self.version += 1
+        await cache_sync.bump("config")
+
+    def snapshot(self, name, builder):
+        # Bitta versiyaga tegishli, o'zgarmas qiymatlar to'plami (masalan narxlar)
+        snap = self._snapshots.get(name)
+        if snap is None:
+            snap = self._snapshots[name] = MappingProxyType(builder())
+        return snap
+
+config = ConfigCache()
+
 def get_config(key, default_value):
-    res = db_query("SELECT value FROM config WHERE key = ?", (key,), fetchone=True)
-    if res: return res[0]
-    db_query("INSERT INTO config (key, value) VALUES (?, ?)", (key, str(default_value)), commit=True)
-    return str(default_value)
+    return config.get(key, default_value)
+
+async def set_config(key, value):
+    await config.set(key, value)
+    if key.startswith("text_"): texts.invalidate(key[len("text_"):])
 
-def set_config(key, value):
-    db_query("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, str(value)), commit=True)
+async def _reload_config():
+    await config.load()
+    texts.invalidate()
+
+cache_sync.register("config", _reload_config)
 
 # Status darajalari (Developer Statusi qo'shildi)
 STATUS_DATA = {
@@ -126,9 +814,12 @@ STATUS_DATA = {
     4: {"name": "💼 Developer", "limit": 500, "desc": f"✅ Akkount sotish imkoniyati\n✅ Pulni Yechib olish\n✅ Limit: 500 {CURRENCY_SYMBOL}"} # Yangi Status
 }
 
-def get_dynamic_prices():
+def _build_prices():
     return {
         "ref_reward": float(get_config("ref_reward", 1.0)),
+        # 2 va 3-daraja referal bonuslari (taklif qilganni taklif qilgan). 0 - o'chirilgan
+        "ref_reward_2": float(get_config("ref_reward_2", 0.0)),
+        "ref_reward_3": float(get_config("ref_reward_3", 0.0)),
         "click_reward": float(get_config("click_reward", 0.05)),
         # Status narxlari (Oyiga)
         "pro_price": float(get_config("status_price_1", 20.0)),  # Silver
@@ -139,38 +830,787 @@ def get_dynamic_prices():
         "proj_sell_commission": float(get_config("proj_sell_commission", 2.5)) 
     }
 
+def get_dynamic_prices():
+    return config.snapshot("prices", _build_prices)
+
 def get_coin_rates():
-    return {
+    return config.snapshot("rates", lambda: {
         "uzs": float(get_config("rate_uzs", 1000.0)), 
         "usd": float(get_config("rate_usd", 0.1))
-    }
-
-def get_text(key, default):
-    # Loyiha/Loyihalar so'zlarini Akkount/Akkountlar ga almashtirish
-    modified_default = default.replace("UzCoin", CURRENCY_SYMBOL).replace("COIN", CURRENCY_SYMBOL).replace("UZC", CURRENCY_SYMBOL).replace("SultanCoin", CURRENCY_SYMBOL)
-    modified_default = modified_default.replace("Loyihalar", "Akkountlar").replace("Loyiha", "Akkount")
-
-    res = get_config(f"text_{key}", modified_default).replace("\\n", "\n")
-    res = res.replace("UzCoin", CURRENCY_SYMBOL).replace("COIN", CURRENCY_SYMBOL).replace("UZC", CURRENCY_SYMBOL).replace("SultanCoin", CURRENCY_SYMBOL)
-    res = res.replace("Loyihalar", "Akkountlar").replace("Loyiha", "Akkount")
-    return res
+    })
+
+# --- KAM O'ZGARADIGAN MA'LUMOTLAR KESHI ---
+class CachedQuery:
+    # So'rov natijasi xotirada saqlanadi (warm-up yoki birinchi murojaatda yuklanadi)
+    # va tegishli admin tahriri invalidate() chaqirganda qayta o'qiladi.
+    def __init__(self, query, params=(), sync_name=None):
+        self.query = query
+        self.params = params
+        self.sync_name = sync_name
+        self.version = 0
+        self._rows = None
+        if sync_name: cache_sync.register(sync_name, lambda: self.invalidate(notify=False))
+
+    async def get(self):
+        if self._rows is None:
+            self._rows = await db_query(self.query, self.params, fetchall=True) or []
+        return self._rows
+
+    def invalidate(self, notify=True):
+        self._rows = None
+        self.version += 1
+        if notify and self.sync_name: cache_sync.notify(self.sync_name)
+
+uc_packages = CachedQuery("SELECT id, uc_amount, uzs_price, usd_price FROM uc_packages ORDER BY uc_amount ASC",
+                          sync_name="uc_packages")
+
+# --- AKKOUNT KARTALARI KESHI ---
+def discount_for_level(level):
+    # Gold - 50% chegirma, Platinum - tekin
+    if level == 2: return 0.5
+    if level == 3: return 1.0
+    return 0
+
+class ProjectCards:
+    # view_project uchun tayyor kartalar (caption, tugmalar, media) (akkount, chegirma darajasi)
+    # bo'yicha keshlanadi. Admin akkountni tahrirlasa/o'chirsa/tasdiqlasa invalidate(pid) chaqiriladi.
+    def __init__(self, max_size=5000):
+        self.max_size = max_size
+        self._cards = OrderedDict()
+
+    async def get(self, pid, discount):
+        key = (pid, discount)
+        card = self._cards.get(key)
+        if card is not None:
+            self._cards.move_to_end(key)
+            return card
+        proj = await db_query("SELECT name, price, description, media_id, media_type, seller_id, is_approved FROM projects WHERE id = ?", (pid,), fetchone=True)
+        if not proj: return None
+        card = self._cards[key] = self._render(pid, discount, *proj)
+        if len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
+        return card
+
+    @staticmethod
+    def _render(pid, discount, name, price, desc, mid, mtype, seller_id, is_approved):
+        final_price = price * (1 - discount)
+        
+        price_text = f"{format_num(price)} {CURRENCY_SYMBOL}"
+        if discount > 0:
+            price_text = f"~{format_num(price)}~ -> **{format_num(final_price)} {CURRENCY_SYMBOL}**"
+            if final_price == 0: price_text = "**TEKIN (Status)**"
+        
+        caption = f"📂 **{name} Akkounti**\n\n📝 {desc}\n\n💰 Narxi: {price_text}"
+        if seller_id: caption += f"\n\n👤 Sotuvchi ID: `{seller_id}`" # Sotuvchi ID ko'rsatildi
+        
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📥 Sotib olish / Yuklash", callback_data=f"buy_proj_{pid}")]])
+        return caption, kb, mid, mtype, is_approved
+
+    def invalidate(self, pid):
+        for key in [key for key in self._cards if key[0] == pid]:
+            del self._cards[key]
+        cache_sync.notify("project_cards")
+
+    def clear(self):
+        self._cards.clear()
+
+project_cards = ProjectCards()
+cache_sync.register("project_cards", project_cards.clear) # Boshqa jarayon qaysi kartani o'zgartirgani noma'lum
+
+# --- AKKOUNTLAR KATALOGI (SAHIFALASH) ---
+CATALOG_STATUS_EMOJI = {1: "✅", 0: "⏳", -1: "❌"}
+
+def catalog_filter(scope):
+    # "a" - sotuvdagilar, "all" - hammasi (admin), "s1"/"s0"/"s-1" - status bo'yicha, "u<id>" - sotuvchi bo'yicha
+    if scope == "a": return "is_approved = 1", ()
+    if scope == "all": return "1 = 1", ()
+    if scope.startswith("s"): return "is_approved = ?", (int(scope[1:]),)
+    if scope.startswith("u"): return "seller_id = ?", (int(scope[1:]),)
+    raise ValueError(f"Noma'lum katalog filtri: {scope}")
+
+class Catalog:
+    # Keyset sahifalash: tugmalar oxirgi/birinchi id ni olib yuradi ("n" - keyingi, "p" - oldingi),
+    # tayyor sahifalar keshlanadi va akkount qo'shilsa/tahrirlansa/o'chirilsa tozalanadi.
+    def __init__(self, page_size=8):
+        self.page_size = page_size
+        self.version = 0
+        self._pages = {}
+
+    def invalidate(self, notify=True):
+        self._pages.clear()
+        self.version += 1
+        if notify: cache_sync.notify("catalog")
+
+    async def fetch(self, scope, direction, cursor):
+        where, params = catalog_filter(scope)
+        if direction == "p":
+            rows = await db_query(f"SELECT id, name, is_approved, seller_id FROM projects WHERE {where} AND id < ? "
+                                  "ORDER BY id DESC LIMIT ?", params + (cursor, self.page_size + 1), fetchall=True) or []
+            has_prev, has_next = len(rows) > self.page_size, True
+            rows = rows[:self.page_size][::-1]
+        else:
+            rows = await db_query(f"SELECT id, name, is_approved, seller_id FROM projects WHERE {where} AND id > ? "
+                                  "ORDER BY id LIMIT ?", params + (cursor, self.page_size + 1), fetchall=True) or []
+            has_prev, has_next = cursor > 0, len(rows) > self.page_size
+            rows = rows[:self.page_size]
+        return rows, has_prev, has_next
+
+    async def render(self, view, scope, direction, cursor):
+        key = (view, scope, direction, cursor)
+        page = self._pages.get(key)
+        if page is None:
+            rows, has_prev, has_next = await self.fetch(scope, direction, cursor)
+            page = self._pages[key] = (self._render_admin if view == "admin" else self._render_user)(scope, rows, has_prev, has_next)
+        return page
+
+    @staticmethod
+    def _nav_row(prefix, scope, rows, has_prev, has_next):
+        nav = []
+        if rows and has_prev: nav.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"{prefix}:{scope}:p:{rows[0][0]}"))
+        if rows and has_next: nav.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"{prefix}:{scope}:n:{rows[-1][0]}"))
+        return nav
+
+    def _render_user(self, scope, rows, has_prev, has_next):
+        if not rows: return "📂 Hozircha akkountlar yuklanmagan.", None
+        kb = [[InlineKeyboardButton(text=f"📁 {name} Akkounti", callback_data=f"view_proj_{pid}")] for pid, name, _, _ in rows]
+        nav = self._nav_row("cat", scope, rows, has_prev, has_next)
+        if nav: kb.append(nav)
+        kb.append([InlineKeyboardButton(text="🔎 Qidirish", callback_data="psearch"),
+                   InlineKeyboardButton(text="🔎 Inline qidiruv", switch_inline_query_current_chat="")])
+        return "📥 Kerakli akkountni tanlang va yuklab oling:", InlineKeyboardMarkup(inline_keyboard=kb)
+
+    def _render_admin(self, scope, rows, has_prev, has_next):
+        labels = {"all": "Hammasi", "s1": "✅ Tasdiqlangan", "s0": "⏳ Kutilmoqda", "s-1": "❌ Rad etilgan"}
+        label = labels.get(scope) or f"👤 Sotuvchi {scope[1:]}"
+        msg = f"✏️ **Tahrirlash uchun Akkountni tanlang:**\n\n🔎 Filtr: {label}"
+        if not rows: msg += "\n\n📂 Akkountlar topilmadi."
+        kb = []
+        for pid, name, is_approved, seller_id in rows:
+            seller_info = f" (Sotuvchi: {seller_id})" if seller_id else ""
+            kb.append([InlineKeyboardButton(text=f"{CATALOG_STATUS_EMOJI.get(is_approved, '❌')} [{pid}] {name} Akkounti{seller_info}",
+                                            callback_data=f"edit_proj:{pid}")])
+        nav = self._nav_row("acat", scope, rows, has_prev, has_next)
+        if nav: kb.append(nav)
+        kb.append([InlineKeyboardButton(text=text, callback_data=f"acat:{key}:n:0") for key, text in
+                   (("all", "Hammasi"), ("s1", "✅"), ("s0", "⏳"), ("s-1", "❌"))])
+        kb.append([InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")])
+        return msg, InlineKeyboardMarkup(inline_keyboard=kb)
+
+catalog = Catalog(page_size=int(os.getenv("CATALOG_PAGE_SIZE", "8")))
+cache_sync.register("catalog", lambda: catalog.invalidate(notify=False))
+
+# --- AKKOUNTLAR QIDIRUVI (FTS5) ---
+# So'rov so'zlari bo'yicha qidiriladi, oxirgisi prefiks ("gold m4" -> "gold" "m4"*), qo'shimcha filtrlar:
+# narx "<100", ">20", "20-100"; admin uchun holat "#all", "#s1", "#s0", "#s-1" (catalog_filter).
+# Natija sahifalari katalog versiyasi bilan keshlanadi - akkount o'zgarsa kesh o'z-o'zidan eskiradi.
+SEARCH_PRICE_RE = re.compile(r"^(?:([<>])(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)-(\d+(?:\.\d+)?))$")
+SEARCH_SCOPES = ("all", "s1", "s0", "s-1")
+
+def parse_search(text, admin=False):
+    # Qaytaradi: (fts so'rovi yoki "", narx_min, narx_max, scope)
+    words, lo, hi, scope = [], None, None, "a"
+    for token in (text or "").lower().split():
+        m = SEARCH_PRICE_RE.match(token)
+        if m:
+            op, value, a, b = m.groups()
+            if op == "<": hi = float(value)
+            elif op == ">": lo = float(value)
+            else: lo, hi = sorted((float(a), float(b)))
+        elif admin and token.startswith("#") and token[1:] in SEARCH_SCOPES:
+            scope = token[1:]
+        else:
+            words.extend(re.findall(r"\w+", token))
+    # Faqat oxirgi so'z prefiks (yozilayotgan so'z) - qolganlari to'liq so'z sifatida, bu moslar sonini kamaytiradi
+    fts = " ".join([f'"{w}"' for w in words[:-1]] + [f'"{w}"*' for w in words[-1:]])
+    return fts, lo, hi, scope
+
+class ProjectSearch:
+    def __init__(self, max_cached=2000):
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._version = catalog.version
+
+    async def search(self, text, offset=0, limit=20, admin=False):
+        # Qaytaradi: ([(id, name, price, description, is_approved)], keyingi offset yoki None)
+        if self._version != catalog.version:
+            self._cache.clear()
+            self._version = catalog.version
+        parsed = parse_search(text, admin)
+        key = (parsed, offset, limit)
+        page = self._cache.get(key)
+        if page is not None:
+            self._cache.move_to_end(key)
+            return page
+        fts, lo, hi, scope = parsed
+        where, params = catalog_filter(scope)
+        if lo is not None:
+            where += " AND price >= ?"
+            params += (lo,)
+        if hi is not None:
+            where += " AND price <= ?"
+            params += (hi,)
+        if fts:
+            query = ("SELECT p.id, p.name, p.price, p.description, p.is_approved FROM projects_fts f JOIN projects p ON p.id = f.rowid "
+                     f"WHERE projects_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ? OFFSET ?")
+            params = (fts,) + params
+        else:
+            query = f"SELECT id, name, price, description, is_approved FROM projects WHERE {where} ORDER BY id DESC LIMIT ? OFFSET ?"
+        rows = await db_query(query, params + (limit + 1, offset), fetchall=True) or []
+        page = self._cache[key] = (rows[:limit], offset + limit if len(rows) > limit else None)
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return page
+
+project_search = ProjectSearch()
+SEARCH_INLINE_PAGE_SIZE = int(os.getenv("SEARCH_INLINE_PAGE_SIZE", "20")) # Telegram chegarasi - 50
+
+async def get_uc_package(pid):
+    for row in await uc_packages.get():
+        if row[0] == pid: return row[1:]
+    return None
+
+# --- MATN SHABLONLARI ---
+# Rebrending almashtirishlari (tartib muhim: "Loyihalar" "Loyiha" dan oldin)
+REBRAND_WORDS = (("UzCoin", CURRENCY_SYMBOL), ("COIN", CURRENCY_SYMBOL), ("UZC", CURRENCY_SYMBOL),
+                 ("SultanCoin", CURRENCY_SYMBOL), ("Loyihalar", "Akkountlar"), ("Loyiha", "Akkount"))
+
+def rebrand(text):
+    for old, new in REBRAND_WORDS:
+        text = text.replace(old, new)
+    return text
+
+TEMPLATE_FIELD = re.compile(r"\{(\w+)\}")
+
+class TextTemplate:
+    # Bir marta kompilyatsiya qilingan matn: {full_name} kabi nomli joylar oldindan ajratib olinadi
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text):
+        self.text = text
+        # Juft indekslar - oddiy matn, toq indekslar - joy nomlari
+        parts = TEMPLATE_FIELD.split(text)
+        self.parts = parts if len(parts) > 1 else None
+
+    def render(self, fields):
+        if self.parts is None: return self.text
+        out = []
+        for idx, part in enumerate(self.parts):
+            if idx % 2 == 0: out.append(part)
+            elif part in fields: out.append(str(fields[part]))
+            else: out.append("{" + part + "}")
+        return "".join(out)
+
+class TextCache:
+    def __init__(self):
+        self._templates = {}
+        self.defaults = {}
+
+    def get(self, key, default):
+        tpl = self._templates.get(key)
+        if tpl is None:
+            self.defaults.setdefault(key, default)
+            raw = get_config(f"text_{key}", default).replace("\\n", "\n")
+            tpl = self._templates[key] = TextTemplate(rebrand(raw))
+        return tpl
+
+    def invalidate(self, key=None):
+        if key is None: self._templates.clear()
+        else: self._templates.pop(key, None)
+
+texts = TextCache()
+
+def get_text(key, default, **fields):
+    return texts.get(key, default).render(fields)
+
+# --- TAYYOR EKRANLAR KESHI ---
+class RenderCache:
+    # Kam o'zgaradigan ekranlar (menyular, klaviaturalar, narx ro'yxatlari) bir marta quriladi va qayta ishlatiladi.
+    # Har bir yozuv o'zi bog'liq versiyalar bilan saqlanadi (config.version, uc_packages.version): admin narx,
+    # to'plam yoki matnni o'zgartirsa versiya oshadi va ekran keyingi murojaatda qayta quriladi.
+    # Qaytarilgan markup obyektlari umumiy - ularni o'zgartirmang, kerak bo'lsa yangi markup yig'ing.
+    def __init__(self, max_size=2000):
+        self.max_size = max_size
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, deps, builder):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == deps:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        if len(self._entries) >= self.max_size: self._entries.clear()
+        value = builder()
+        self._entries[key] = (deps, value)
+        return value
+
+screens = RenderCache()
+
+# --- REYTING (LEADERBOARD) ---
+class Leaderboard:
+    # Top-N xotirada saqlanadi va balans o'zgarganda qisman yangilanadi.
+    # Invariant: balansi `floor` dan katta bo'lgan barcha foydalanuvchilar `_entries` ichida.
+    # To'liq qayta hisoblash faqat sovuq startda yoki ro'yxat N dan kichrayib qolganda.
+    # Bir nechta jarayonda balanslarni boshqalar ham o'zgartiradi - invariant saqlanmaydi, shuning
+    # uchun `ttl` berilsa top har `ttl` sekundda bazadan qayta o'qiladi.
+    def __init__(self, size=10, reserve=20, ttl=None, rank_ttl=300, rank_cache_size=50000):
+        self.size = size
+        self.capacity = size + reserve
+        self.ttl = ttl
+        self.rank_ttl = rank_ttl
+        self.rank_cache_size = rank_cache_size
+        self._ranks = OrderedDict() # top dan tashqaridagilar: user_id -> (o'rin, amal qilish muddati)
+        self._entries = {}
+        self._floor = None
+        self._top = None
+        self._loaded_at = 0.0
+        self.loaded = False
+
+    async def load(self):
+        rows = await db_query("SELECT id, balance, status_level FROM users ORDER BY balance DESC LIMIT ?",
+                              (self.capacity,), fetchall=True) or []
+        self._entries = {uid: (bal, lvl or 0) for uid, bal, lvl in rows}
+        # Kam qator qaytsa - barcha foydalanuvchilar xotirada
+        self._floor = rows[-1][1] if len(rows) >= self.capacity else float("-inf")
+        self._top = None
+        self._loaded_at = time.monotonic()
+        self.loaded = True
+
+    def update(self, user_id, balance, level=None):
+        if not self.loaded: return
+        old = self._entries.get(user_id)
+        if level is None: level = old[1] if old else 0
+        if balance > self._floor:
+            self._entries[user_id] = (balance, level or 0)
+            if len(self._entries) > self.capacity * 2:
+                self._trim()
+        elif old is None:
+            return
+        else:
+            del self._entries[user_id]
+        self._top = None
+
+    def _trim(self):
+        ranked = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)
+        self._entries = dict(ranked[:self.capacity])
+        self._floor = max(self._floor, ranked[self.capacity][1][0])
+
+    async def top(self):
+        if (not self.loaded or len(self._entries) < min(self.size, self.capacity) and self._floor != float("-inf")
+                or self.ttl and time.monotonic() - self._loaded_at > self.ttl):
+            await self.load()
+        if self._top is None:
+            ranked = sorted(self._entries.items(), key=lambda item: item[1][0], reverse=True)[:self.size]
+            self._top = [(uid, bal, lvl) for uid, (bal, lvl) in ranked]
+        return self._top
+
+    async def rank(self, user_id):
+        top = await self.top()
+        for idx, (uid, _, _) in enumerate(top, 1):
+            if uid == user_id: return idx
+        # Top dan tashqarida o'rin COUNT bilan hisoblanadi - bu balansi yuqori barcha foydalanuvchilarni
+        # indeks bo'yicha sanash demak (kichik balanslarda deyarli butun jadval), shuning uchun natija
+        # `rank_ttl` sekund keshlanadi va o'sha vaqt ichida taxminiy bo'ladi.
+        now = time.monotonic()
+        cached = self._ranks.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        row = await db_query("SELECT 1 + (SELECT COUNT(*) FROM users WHERE balance > u.balance) FROM users u WHERE u.id = ?",
+                             (user_id,), fetchone=True)
+        rank = row[0] if row else None
+        self._ranks[user_id] = (rank, now + self.rank_ttl)
+        self._ranks.move_to_end(user_id)
+        while len(self._ranks) > self.rank_cache_size:
+            self._ranks.popitem(last=False)
+        return rank
+
+leaderboard = Leaderboard(ttl=float(os.getenv("LEADERBOARD_TTL", "5")) if MULTI_PROCESS else None,
+                          rank_ttl=float(os.getenv("LEADERBOARD_RANK_TTL", "300")))
+
+# --- KUNLIK STATISTIKA ---
+# Balansni o'zgartiruvchi har bir hodisa daily_stats dagi (kun, metrika) qatoriga shu hodisaning
+# o'z tranzaksiyasida qo'shiladi. /stats faqat oxirgi 30 kunlik qatorlarni o'qiydi - foydalanuvchilar
+# soniga bog'liq emas.
+STATS_METRICS = {
+    "new_user": "👤 Yangi foydalanuvchilar",
+    "ref_reward": "👥 Referal bonuslari",
+    "click": "👆 Clicker",
+    "topup": "📥 Hisob to'ldirish",
+    "withdraw": "💸 Pul yechish",
+    "uc": "🎮 UC sotuvlari",
+    "status": "💎 Status sotuvlari",
+    "project_sale": "🛒 Akkount sotuvlari",
+    "transfer": "🔄 O'tkazmalar",
+}
 
-def get_user_data(user_id):
-    res = db_query("SELECT balance, status_level, status_expire FROM users WHERE id = ?", (user_id,), fetchone=True)
+def stats_day(ts=None):
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+def _tx_track(conn, events):
+    # events: [(metric, soni, summa)]
+    day = stats_day()
+    conn.executemany("INSERT INTO daily_stats (day, metric, events, amount) VALUES (?, ?, ?, ?) "
+                     "ON CONFLICT(day, metric) DO UPDATE SET events = events + excluded.events, amount = COALESCE(amount, 0) + excluded.amount",
+                     [(day, metric, count, amount or 0.0) for metric, count, amount in events if count])
+
+async def stats_windows(windows=(1, 7, 30)):
+    # {oyna: {metrika: (soni, summa)}} - eng katta oyna bo'yicha bitta so'rov
+    today = datetime.date.today()
+    since = {w: (today - datetime.timedelta(days=w - 1)).isoformat() for w in windows}
+    rows = await db_query("SELECT day, metric, events, COALESCE(amount, 0) FROM daily_stats WHERE day >= ?",
+                          (min(since.values()),), fetchall=True) or []
+    result = {w: {} for w in windows}
+    for day, metric, count, amount in rows:
+        for w in windows:
+            if day >= since[w]:
+                prev = result[w].get(metric, (0, 0.0))
+                result[w][metric] = (prev[0] + count, prev[1] + amount)
+    return result
+
+# --- PUL OQIMLARI (TRANZAKSIYALAR) ---
+class InsufficientFunds(Exception):
+    pass
+
+def _tx_move_balance(conn, debits, credits, status, events=(), notices=()):
+    # Bitta atomik birlik: avval tekshirib yechish (check-and-set), keyin qo'shish, kerak bo'lsa status.
+    # events - shu o'zgarish uchun kunlik statistikaga yoziladigan hodisalar,
+    # notices - shu o'zgarish bilan birga outboxga yoziladigan xabarlar [(chat_id, matn, parse_mode)]
+    changes = {}
+    for uid, amount in debits:
+        row = conn.execute("UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ? RETURNING balance, status_level",
+                           (amount, uid, amount)).fetchone()
+        if row is None: raise InsufficientFunds(uid)
+        changes[uid] = row
+    for uid, amount in credits:
+        row = conn.execute("UPDATE users SET balance = balance + ? WHERE id = ? RETURNING balance, status_level",
+                           (amount, uid)).fetchone()
+        if row is None: raise LookupError(f"Foydalanuvchi topilmadi: {uid}")
+        changes[uid] = row
+    if status:
+        uid, level, expire_at = status
+        row = conn.execute("UPDATE users SET status_level = ?, status_expire_at = ?, status_reminded = 0 WHERE id = ? "
+                           "RETURNING balance, status_level", (level, expire_at, uid)).fetchone()
+        if row is None: raise LookupError(f"Foydalanuvchi topilmadi: {uid}")
+        changes[uid] = row
+    if events: _tx_track(conn, events)
+    if notices: _tx_enqueue(conn, notices)
+    return changes
+
+async def move_balance(debits=(), credits=(), status=None, events=(), notices=()):
+    # Balans tekshiruvi, barcha yechish va qo'shishlar bitta BEGIN IMMEDIATE tranzaksiyasida.
+    # Mablag' yetmasa InsufficientFunds ko'tariladi va hech narsa o'zgarmaydi.
+    for uid, _ in debits:
+        if clicks.pending(uid): await clicks.flush() # Yig'ilgan clicker daromadi ham hisobga kirsin
+    changes = await db.transaction(_tx_move_balance, tuple(debits), tuple(credits), status, tuple(events), tuple(notices))
+    for uid, (balance, level) in changes.items():
+        leaderboard.update(uid, balance, level)
+    if notices: outbox.wake()
+    return changes
+
+# --- CLICKER: YOZUVLARNI JAMLASH ---
+class ClickAccumulator:
+    # Har bir bosish uchun alohida UPDATE o'rniga daromad xotirada yig'iladi va
+    # interval yoki hajm chegarasida bitta tranzaksiyada users.balance ga yoziladi.
+    def __init__(self, interval=2.0, max_clicks=500):
+        self.interval = interval
+        self.max_clicks = max_clicks
+        self._pending = {}
+        self._inflight = {}
+        self._clicks = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._flush_task = None
+
+    def add(self, user_id, amount):
+        self._pending[user_id] = self._pending.get(user_id, 0.0) + amount
+        self._clicks += 1
+        if self._clicks >= self.max_clicks and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    def pending(self, user_id):
+        return self._pending.get(user_id, 0.0) + self._inflight.get(user_id, 0.0)
+
+    def discard(self, user_id):
+        # Admin balansni to'g'ridan-to'g'ri o'rnatganda yig'ilgan daromad bekor qilinadi
+        self._pending.pop(user_id, None)
+
+    @staticmethod
+    def _write(conn, items, count):
+        rows = [conn.execute("UPDATE users SET balance = balance + ? WHERE id = ? RETURNING id, balance, status_level",
+                             (amount, uid)).fetchone() for uid, amount in items]
+        _tx_track(conn, [("click", count, sum(amount for _, amount in items))])
+        return rows
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending: return
+            self._inflight, self._pending = self._pending, {}
+            count, self._clicks = self._clicks, 0
+            try:
+                rows = await db.transaction(self._write, list(self._inflight.items()), count)
+                for row in rows:
+                    if row: leaderboard.update(*row)
+            except Exception as e:
+                logging.error(f"Clicker yozishda xatolik: {e}")
+                for uid, amount in self._inflight.items():
+                    self._pending[uid] = self._pending.get(uid, 0.0) + amount
+                self._clicks += count
+            finally:
+                self._inflight = {}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
+
+clicks = ClickAccumulator(interval=float(os.getenv("CLICK_FLUSH_INTERVAL", "2")),
+                          max_clicks=int(os.getenv("CLICK_FLUSH_SIZE", "500")))
+
+async def get_user_data(user_id):
+    # Faqat o'qish: muddati o'tgan status shu yerda 0 deb ko'rsatiladi,
+    # bazadagi yozuvni esa StatusScheduler fonda tushiradi.
+    res = await db_query("SELECT balance, status_level, status_expire_at FROM users WHERE id = ?", (user_id,), fetchone=True)
     if not res: return None
     
-    balance, level, expire = res
-    if expire:
-        expire_dt = datetime.datetime.strptime(expire, "%Y-%m-%d %H:%M:%S")
-        if datetime.datetime.now() > expire_dt:
-            db_query("UPDATE users SET status_level = 0, status_expire = NULL WHERE id = ?", (user_id,), commit=True)
-            level = 0
-            expire = None
-    return {"balance": balance, "level": level, "expire": expire}
+    balance, level, expire_at = res
+    level = level or 0
+    if expire_at and expire_at <= time.time():
+        level, expire_at = 0, None
+    expire = datetime.datetime.fromtimestamp(expire_at).strftime("%Y-%m-%d %H:%M:%S") if expire_at else None
+    balance += clicks.pending(user_id) # Hali bazaga yozilmagan clicker daromadi
+    return {"balance": balance, "level": level, "expire": expire, "expire_at": expire_at}
+
+# --- STATUS MUDDATI (FON REJALASHTIRUVCHI) ---
+class StatusScheduler:
+    # Har `interval` sekundda muddati tugagan statuslarni bitta UPDATE bilan tushiradi va
+    # tugashiga `remind_before` sekund qolganlarga bir martalik eslatma yuboradi.
+    def __init__(self, interval=60, remind_before=3 * 86400):
+        self.interval = interval
+        self.remind_before = remind_before
+        self._task = None
+
+    async def sweep(self):
+        now = int(time.time())
+        expired = await db_query("UPDATE users SET status_level = 0, status_expire_at = NULL "
+                                 "WHERE status_expire_at <= ? RETURNING id, balance, status_level",
+                                 (now,), fetchall=True, commit=True) or []
+        reminders = await db_query("UPDATE users SET status_reminded = 1 "
+                                   "WHERE status_expire_at > ? AND status_expire_at <= ? AND status_reminded = 0 "
+                                   "RETURNING id, status_level, status_expire_at",
+                                   (now, now + self.remind_before), fetchall=True, commit=True) or []
+        notices = []
+        for uid, balance, level in expired:
+            leaderboard.update(uid, balance, level)
+            notices.append((uid, "⌛ Statusingiz muddati tugadi. Imkoniyatlarni qayta ochish uchun 🌟 Statuslar bo'limiga o'ting.", None))
+        for uid, level, expire_at in reminders:
+            days = max(1, -(-(expire_at - now) // 86400))
+            name = STATUS_DATA.get(level, STATUS_DATA[0])['name']
+            notices.append((uid, f"⏳ Sizning {name} statusingiz {days} kundan keyin tugaydi.", None))
+        await outbox.enqueue_many(notices)
+
+    async def _run(self):
+        while True:
+            try: await self.sweep()
+            except Exception as e: logging.error(f"Status tekshiruvida xatolik: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+statuses = StatusScheduler(interval=float(os.getenv("STATUS_SWEEP_INTERVAL", "60")))
 
 def format_num(num):
     return f"{float(num):.2f}".rstrip('0').rstrip('.')
 
+# --- BUYURTMALAR (UC, HISOB TO'LDIRISH, PUL YECHISH) ---
+# Har bir so'rov orders jadvalida saqlanadi: pending -> approved / rejected. Holat faqat pending dan
+# o'zgaradi (UPDATE ... WHERE state = 'pending'), shuning uchun tasdiqlashni ikki marta bosish pulni
+# ikki marta qo'shmaydi. Balans o'zgarishlari holat o'zgarishi bilan bitta tranzaksiyada.
+ORDER_KINDS = {"uc": "🎮 UC", "topup": "📥 To'lov", "withdraw": "💸 Yechish"}
+
+def _tx_create_order(conn, kind, user_id, amount, details, debit):
+    changes = _tx_move_balance(conn, [(user_id, amount)], (), None) if debit else {}
+    order_id = conn.execute("INSERT INTO orders (kind, user_id, amount, details, created_at) VALUES (?, ?, ?, ?, ?) RETURNING id",
+                            (kind, user_id, amount, json.dumps(details, ensure_ascii=False), int(time.time()))).fetchone()[0]
+    return order_id, changes
+
+def _tx_adopt_order(conn, kind, user_id, amount, details, chat_id, message_id):
+    # Admin xabari uchun buyurtma bor bo'lsa o'shani, bo'lmasa yangi pending buyurtmani qaytaradi
+    row = conn.execute("SELECT id FROM orders WHERE admin_chat_id = ? AND admin_message_id = ?", (chat_id, message_id)).fetchone()
+    if row: return row[0]
+    return conn.execute("INSERT INTO orders (kind, user_id, amount, details, admin_chat_id, admin_message_id, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                        (kind, user_id, amount, json.dumps(details, ensure_ascii=False), chat_id, message_id, int(time.time()))).fetchone()[0]
+
+def _tx_decide_orders(conn, ids, approve):
+    marks = ",".join("?" * len(ids))
+    rows = conn.execute(f"UPDATE orders SET state = ?, decided_at = ? WHERE state = 'pending' AND id IN ({marks}) "
+                        "RETURNING id, kind, user_id, amount, details, admin_chat_id, admin_message_id",
+                        ("approved" if approve else "rejected", int(time.time()), *ids)).fetchall()
+    # Tasdiqlangan to'lov - hisobga qo'shiladi, rad etilgan yechish - yechilgan pul qaytariladi
+    refund_kind = "topup" if approve else "withdraw"
+    credits = [(uid, amount) for _, kind, uid, amount, *_ in rows if kind == refund_kind]
+    changes = _tx_move_balance(conn, (), credits, None) if credits else {}
+    if approve:
+        # UC buyurtmalarida summa yo'q (amount NULL) - faqat soni hisoblanadi
+        _tx_track(conn, [(kind, 1, amount or 0.0) for _, kind, _, amount, *_ in rows])
+    # Foydalanuvchi xabarlari holat bilan birga outboxga yoziladi
+    _tx_enqueue(conn, [(uid, Orders.notice(kind, amount, json.loads(details or "{}"), approve), None)
+                       for _, kind, uid, amount, details, _, _ in rows])
+    return sorted(rows), changes
+
+class Orders:
+    def __init__(self, page_size=10):
+        self.page_size = page_size
+        self._tasks = set()
+
+    async def create(self, kind, user_id, amount, details, debit=False):
+        # debit=True: summa foydalanuvchidan buyurtma bilan birga yechiladi (mablag' yetmasa InsufficientFunds)
+        if debit and clicks.pending(user_id): await clicks.flush()
+        order_id, changes = await db.transaction(_tx_create_order, kind, user_id, amount, details, debit)
+        for uid, (balance, level) in changes.items():
+            leaderboard.update(uid, balance, level)
+        return order_id
+
+    async def adopt(self, kind, user_id, amount, details, admin_message):
+        # Buyurtmalar jadvalidan oldin yuborilgan admin xabari uchun buyurtma (balans o'zgarmaydi).
+        # Bir xabar uchun doim bitta buyurtma, shuning uchun qayta bosish ikkinchi marta hal qilmaydi.
+        return await db.transaction(_tx_adopt_order, kind, user_id, amount, details,
+                                    admin_message.chat.id, admin_message.message_id)
+
+    async def attach(self, order_id, admin_message):
+        await db_query("UPDATE orders SET admin_chat_id = ?, admin_message_id = ? WHERE id = ?",
+                       (admin_message.chat.id, admin_message.message_id, order_id), commit=True)
+
+    async def decide(self, ids, approve, skip_message_id=None):
+        # Faqat hali pending bo'lganlari o'zgaradi. O'zgargan buyurtmalar ro'yxati qaytariladi.
+        # Foydalanuvchi xabarlari outbox orqali ketadi (bir odamniki bitta xabarga jamlanadi).
+        if not ids: return []
+        rows, changes = await db.transaction(_tx_decide_orders, tuple(ids), approve)
+        for uid, (balance, level) in changes.items():
+            leaderboard.update(uid, balance, level)
+        if rows:
+            outbox.wake()
+            task = asyncio.create_task(self._clear_buttons(rows, skip_message_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return rows
+
+    @staticmethod
+    def notice(kind, amount, details, approve):
+        if kind == "uc":
+            if approve: return f"✅ **UC Muvaffaqiyatli Yuklandi!**\nHisobingizga {details['uc_amount']} UC qo'shildi."
+            return "❌ UC buyurtmangiz rad etildi. Iltimos, admin bilan bog'laning (ID xato bo'lishi mumkin)."
+        if kind == "topup":
+            if approve: return f"✅ **To'lov tasdiqlandi!**\nHisobingizga +{format_num(amount)} {CURRENCY_SYMBOL} qo'shildi."
+            return "❌ To'lovingiz rad etildi. Iltimos, admin bilan bog'laning."
+        if approve: return f"✅ **Pulni Yechib Olish Tasdiqlandi!**\n{format_num(amount)} {CURRENCY_SYMBOL} `{details['card']}` kartangizga o'tkazildi."
+        return f"❌ Pul yechib olish rad etildi. Hisobingizga {format_num(amount)} {CURRENCY_SYMBOL} qaytarildi."
+
+    async def _clear_buttons(self, rows, skip_message_id):
+        # Hal qilingan buyurtmalarning admin xabarlaridagi tugmalar olib tashlanadi
+        for order_id, _, _, _, _, chat_id, message_id in rows:
+            if not message_id or message_id == skip_message_id: continue
+            await broadcasts.bucket.acquire()
+            try: await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+            except Exception: pass
+
+    async def pending_counts(self):
+        rows = await db_query("SELECT kind, COUNT(*) FROM orders WHERE state = 'pending' GROUP BY kind", fetchall=True) or []
+        return dict(rows)
+
+    async def pending(self, kind=None, upto_id=None):
+        query = "SELECT id, kind, user_id, amount, details, created_at FROM orders WHERE state = 'pending'"
+        params = []
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if upto_id is not None:
+            query += " AND id <= ?"
+            params.append(upto_id)
+        query += " ORDER BY created_at, id LIMIT ?"
+        return await db_query(query, (*params, self.page_size), fetchall=True) or []
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+orders = Orders(page_size=int(os.getenv("ORDERS_PAGE_SIZE", "10")))
+
+# --- REFERALLAR ---
+# Har bir taklif qiluvchi uchun referral_stats da tayyor hisoblagichlar (1/2/3-daraja takliflar va
+# ishlangan bonus) saqlanadi. Ular yangi foydalanuvchi qo'shilgan tranzaksiyaning o'zida oshiriladi,
+# shuning uchun "Referallarim" va top referallar users jadvalini skan qilmaydi.
+REFERRAL_LEVELS = 3
+
+def _tx_register_user(conn, user_id, referrer_id, rewards):
+    # Yangi foydalanuvchi, referal zanjiri bo'yicha bonuslar, hisoblagichlar va xabarlar - bitta birlik
+    ancestors = []
+    parent = referrer_id
+    while parent is not None and len(ancestors) < REFERRAL_LEVELS:
+        row = conn.execute("SELECT referrer_id FROM users WHERE id = ?", (parent,)).fetchone()
+        if row is None: break # Bunday taklif qiluvchi yo'q
+        ancestors.append(parent)
+        parent = row[0]
+    created = conn.execute("INSERT INTO users (id, balance, referrer_id) VALUES (?, 0.0, ?) ON CONFLICT(id) DO NOTHING RETURNING id",
+                           (user_id, ancestors[0] if ancestors else None)).fetchone()
+    if not created: return False, {}
+
+    credits, notices = [], []
+    for level, (ancestor, reward) in enumerate(zip(ancestors, rewards), 1):
+        conn.execute(f"INSERT INTO referral_stats (user_id, level{level}, earned) VALUES (?, 1, ?) "
+                     f"ON CONFLICT(user_id) DO UPDATE SET level{level} = level{level} + 1, earned = earned + excluded.earned",
+                     (ancestor, reward))
+        if reward > 0: credits.append((ancestor, reward))
+        if level == 1:
+            notices.append((ancestor, f"🎉 Sizda yangi referal! +{format_num(reward)} {CURRENCY_SYMBOL}", None))
+        elif reward > 0:
+            notices.append((ancestor, f"🎉 {level}-daraja referal! +{format_num(reward)} {CURRENCY_SYMBOL}", None))
+    changes = _tx_move_balance(conn, (), credits, None) if credits else {}
+    _tx_track(conn, [("new_user", 1, 0.0), ("ref_reward", len(credits), sum(amount for _, amount in credits))])
+    _tx_enqueue(conn, notices)
+    return True, changes
+
+async def register_user(user_id, referrer_id=None):
+    # Yangi foydalanuvchi qo'shilsa True (parallel /start larda faqat bittasi qo'shadi)
+    prices = get_dynamic_prices()
+    rewards = (prices['ref_reward'], prices['ref_reward_2'], prices['ref_reward_3'])
+    created, changes = await db.transaction(_tx_register_user, user_id, referrer_id, rewards)
+    if created: leaderboard.update(user_id, 0.0, 0)
+    for uid, (balance, level) in changes.items():
+        leaderboard.update(uid, balance, level)
+    if created and referrer_id: outbox.wake()
+    return created
+
+async def get_referral_stats(user_id):
+    row = await db_query("SELECT level1, level2, level3, earned FROM referral_stats WHERE user_id = ?", (user_id,), fetchone=True)
+    return row or (0, 0, 0, 0.0)
+
+async def top_referrers(limit=10):
+    return await db_query("SELECT user_id, level1, earned FROM referral_stats WHERE level1 > 0 ORDER BY level1 DESC LIMIT ?",
+                          (limit,), fetchall=True) or []
+
 # --- STATES ---
 class AdminState(StatesGroup):
     edit_balance_id = State()
@@ -234,21 +1674,31 @@ class Withdraw(StatesGroup):
     waiting_for_card = State()
     waiting_for_amount = State()
 
+class CatalogSearch(StatesGroup):
+    waiting_for_query = State()
+
 # --- KEYBOARDS ---
 def main_menu(user_id):
+    return screens.get("main_menu", (), _build_main_menu)
+
+def _build_main_menu():
     kb = [
         [KeyboardButton(text="👤 Kabinet"), KeyboardButton(text="🌟 Statuslar")],
         [KeyboardButton(text="💎 UC Sotib olish"), KeyboardButton(text="📂 Akkountlar")], 
         [KeyboardButton(text="💳 Hisobni to'ldirish"), KeyboardButton(text="💸 Pul ishlash")],
-        [KeyboardButton(text="🤝 Hamkorlik"), KeyboardButton(text="🏆 Top Foydalanuvchilar")] # Hamkorlik qo'shildi
+        [KeyboardButton(text="🤝 Hamkorlik"), KeyboardButton(text="🏆 Top Foydalanuvchilar")], # Hamkorlik qo'shildi
+        [KeyboardButton(text="👥 Referallarim")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
 def cancel_kb():
-    return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="🚫 Bekor qilish")]], resize_keyboard=True)
+    return screens.get("cancel_kb", (), lambda: ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="🚫 Bekor qilish")]], resize_keyboard=True))
 
 # ... (edit_proj_kb va edit_uc_kb o'zgarishsiz) ...
 def edit_proj_kb(pid):
+    return screens.get(("edit_proj_kb", pid), (), lambda: _build_edit_proj_kb(pid))
+
+def _build_edit_proj_kb(pid):
     kb = [
         [InlineKeyboardButton(text="✏️ Nomini tahrirlash", callback_data=f"ep_name:{pid}"),
          InlineKeyboardButton(text="💰 Narxini tahrirlash", callback_data=f"ep_price:{pid}")],
@@ -261,6 +1711,9 @@ def edit_proj_kb(pid):
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 def edit_uc_kb(pid):
+    return screens.get(("edit_uc_kb", pid), (), lambda: _build_edit_uc_kb(pid))
+
+def _build_edit_uc_kb(pid):
     kb = [
         [InlineKeyboardButton(text="✏️ UC Miqdorini tahrirlash", callback_data=f"eu_amount:{pid}")],
         [InlineKeyboardButton(text="💰 UZS Narxini tahrirlash", callback_data=f"eu_uzs:{pid}"),
@@ -271,6 +1724,74 @@ def edit_uc_kb(pid):
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
 
+# --- ANTI-SPAM (THROTTLING) ---
+# Handler guruhlari: (sekundiga token, maksimal portlash). Guruh handlerda flags={"throttle": ...}
+# orqali beriladi, flagsiz handlerlar "default" guruhida. Admin cheklanmaydi.
+THROTTLE_GROUPS = {
+    "default": (3.0, 10),
+    "clicker": (float(os.getenv("THROTTLE_CLICKER_RATE", "6")), 15),
+    "purchase": (0.5, 3),
+    "search": (2.0, 10),
+}
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Har bir (foydalanuvchi, guruh) uchun token-bucket: xotirada faqat [tokenlar, vaqt] juftligi.
+    # `idle` sekund faol bo'lmagan bucketlar tozalanadi (ular baribir to'lib bo'lgan bo'ladi).
+    def __init__(self, groups, idle=120):
+        self.groups = groups
+        self.idle = idle
+        self._buckets = {}
+        self._last_evict = time.monotonic()
+        self.passed = Counter()
+        self.throttled = Counter()
+
+    def _allow(self, user_id, group):
+        rate, burst = self.groups.get(group, self.groups["default"])
+        now = time.monotonic()
+        bucket = self._buckets.get((user_id, group))
+        if bucket is None:
+            bucket = self._buckets[(user_id, group)] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if now - self._last_evict > self.idle:
+            self._evict(now)
+        if bucket[0] < 1: return False
+        bucket[0] -= 1
+        return True
+
+    def _evict(self, now):
+        self._last_evict = now
+        for key in [key for key, (_, ts) in self._buckets.items() if now - ts > self.idle]:
+            del self._buckets[key]
+
+    def stats(self):
+        return {"active_buckets": len(self._buckets), "passed": dict(self.passed), "throttled": dict(self.throttled)}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id == ADMIN_ID:
+            return await handler(event, data)
+        group = get_flag(data, "throttle") or "default"
+        if self._allow(user.id, group):
+            self.passed[group] += 1
+            return await handler(event, data)
+        self.throttled[group] += 1
+        metrics.inc("bot_throttled_total", group=group)
+        if isinstance(event, types.CallbackQuery):
+            await event.answer("⏳ Juda tez! Biroz kuting.", cache_time=1)
+
+throttle = ThrottlingMiddleware(THROTTLE_GROUPS)
+dp.message.middleware(throttle)
+dp.callback_query.middleware(throttle)
+dp.inline_query.middleware(throttle)
+
+# Handler vaqtlari anti-spamdan keyin o'lchanadi (to'xtatilgan updatelar bot_throttled_total da)
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.inline_query.middleware(handler_metrics)
+
 # --------------------------------------------------------------------------------
 # --- 🔥 MUHIM FIX: BEKOR QILISH HANDLERI (ENG TEPADA) ---
 # --------------------------------------------------------------------------------
@@ -289,36 +1810,38 @@ async def cancel_all_handler(message: types.Message, state: FSMContext):
 @dp.message(CommandStart())
 async def cmd_start(message: types.Message, command: CommandObject):
     referrer_id = None
+    open_project = None
     args = command.args
     
     if args and args.isdigit():
         referrer_id = int(args)
         if referrer_id == message.from_user.id: referrer_id = None
+    elif args and args.startswith("proj_") and args[5:].isdigit():
+        open_project = int(args[5:]) # Inline qidiruvdan kelgan havola: t.me/<bot>?start=proj_<id>
     
-    if not db_query("SELECT id FROM users WHERE id = ?", (message.from_user.id,), fetchone=True):
-        db_query("INSERT INTO users (id, balance, referrer_id) VALUES (?, 0.0, ?)", 
-                 (message.from_user.id, referrer_id), commit=True)
-        
-        if referrer_id:
-            reward = get_dynamic_prices()['ref_reward']
-            db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (reward, referrer_id), commit=True)
-            try:
-                await bot.send_message(referrer_id, f"🎉 Sizda yangi referal! +{format_num(reward)} {CURRENCY_SYMBOL}")
-            except: pass
+    existing = await db_query("SELECT is_blocked FROM users WHERE id = ?", (message.from_user.id,), fetchone=True)
+    if existing and existing[0]:
+        # Botni blokdan chiqargan foydalanuvchi yana broadcastlarni oladi
+        await db_query("UPDATE users SET is_blocked = 0 WHERE id = ?", (message.from_user.id,), commit=True)
+    if not existing:
+        await register_user(message.from_user.id, referrer_id)
 
     welcome_text = get_text("welcome", 
-                            f"👋 Assalomu alaykum, {message.from_user.full_name}!\n\n"
-                            f"🤖 Bot ilovasidan yoki menyudan foydalaning!🖥\n"
-                            f"Bu yerda siz UC sotib olishingiz yoki akkount sotib olishingiz mumkin.")
+                            "👋 Assalomu alaykum, {full_name}!\n\n"
+                            "🤖 Bot ilovasidan yoki menyudan foydalaning!🖥\n"
+                            "Bu yerda siz UC sotib olishingiz yoki akkount sotib olishingiz mumkin.",
+                            full_name=message.from_user.full_name)
     
     await message.answer(welcome_text, reply_markup=main_menu(message.from_user.id), parse_mode="Markdown")
+    if open_project and not await send_project_card(message.chat.id, message.from_user.id, open_project):
+        await message.answer("Akkount topilmadi.")
 
 @dp.message(F.text == "👤 Kabinet")
 async def kabinet(message: types.Message):
-    data = get_user_data(message.from_user.id)
+    data = await get_user_data(message.from_user.id)
     if data is None: # Agar qandaydir sabab bilan user bazada bo'lmasa
         await cmd_start(message, CommandObject(text="/start", prefix="/", args=""))
-        data = get_user_data(message.from_user.id)
+        data = await get_user_data(message.from_user.id)
     
     status_name = STATUS_DATA[data['level']]['name']
     limit = STATUS_DATA[data['level']]['limit']
@@ -336,9 +1859,9 @@ async def kabinet(message: types.Message):
 
 @dp.message(F.text == "💸 Pul ishlash")
 async def earn_money(message: types.Message):
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     prices = get_dynamic_prices()
-    bot_username = (await bot.get_me()).username
+    bot_username = (await bot.me()).username # bot.me() natijani keshlaydi
     ref_link = f"https://t.me/{bot_username}?start={message.from_user.id}"
     
     msg = (f"🔗 **Referal havolangiz:**\n`{ref_link}`\n\n"
@@ -355,14 +1878,14 @@ async def earn_money(message: types.Message):
         
     await message.answer(msg, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_rows), parse_mode="Markdown")
 
-@dp.callback_query(F.data == "clicker_process")
+@dp.callback_query(F.data == "clicker_process", flags={"throttle": "clicker"})
 async def process_click(callback: types.CallbackQuery):
-    user = get_user_data(callback.from_user.id)
+    user = await get_user_data(callback.from_user.id)
     if user['level'] < 1:
         return await callback.answer("Faqat Silver va yuqori statusdagilar uchun!", show_alert=True)
     
     reward = get_dynamic_prices()['click_reward']
-    db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (reward, callback.from_user.id), commit=True)
+    clicks.add(callback.from_user.id, reward)
     await callback.answer(f"+{format_num(reward)} {CURRENCY_SYMBOL}", cache_time=1)
 
 @dp.message(F.text == "🌟 Statuslar")
@@ -374,6 +1897,13 @@ async def cb_status_shop(callback: types.CallbackQuery):
     await show_status_menu(callback.message)
 
 async def show_status_menu(message: types.Message):
+    info, kb = screens.get("status_menu", (config.version,), _build_status_menu)
+    if isinstance(message, types.CallbackQuery):
+        await message.message.edit_text(info, reply_markup=kb, parse_mode="Markdown")
+    else:
+        await message.answer(info, reply_markup=kb, parse_mode="Markdown")
+
+def _build_status_menu():
     prices = get_dynamic_prices()
     kb = [
         [InlineKeyboardButton(text=f"🥈 Silver ({prices['pro_price']} {CURRENCY_SYMBOL})", callback_data="buy_status_1")], 
@@ -387,13 +1917,9 @@ async def show_status_menu(message: types.Message):
             f"🥇 **GOLD** - {prices['prem_price']} {CURRENCY_SYMBOL}\n{STATUS_DATA[2]['desc']}\n\n"
             f"💎 **PLATINUM** - {prices['king_price']} {CURRENCY_SYMBOL}\n{STATUS_DATA[3]['desc']}\n\n"
             f"💼 **DEVELOPER** - {prices['dev_price']} {CURRENCY_SYMBOL}\n{STATUS_DATA[4]['desc']}") # Developer qo'shildi
-    
-    if isinstance(message, types.CallbackQuery):
-        await message.message.edit_text(info, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
-    else:
-        await message.answer(info, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
+    return info, InlineKeyboardMarkup(inline_keyboard=kb)
 
-@dp.callback_query(F.data.startswith("buy_status_"))
+@dp.callback_query(F.data.startswith("buy_status_"), flags={"throttle": "purchase"})
 async def buy_status_handler(callback: types.CallbackQuery):
     lvl = int(callback.data.split("_")[-1])
     prices = get_dynamic_prices()
@@ -402,7 +1928,7 @@ async def buy_status_handler(callback: types.CallbackQuery):
     
     if cost is None: return await callback.answer("Noto'g'ri status raqami.", show_alert=True)
     
-    user = get_user_data(callback.from_user.id)
+    user = await get_user_data(callback.from_user.id)
     
     if user['level'] >= lvl:
         return await callback.answer("Sizda allaqachon bu yoki undan yuqori status bor!", show_alert=True)
@@ -410,17 +1936,20 @@ async def buy_status_handler(callback: types.CallbackQuery):
     if user['balance'] < cost:
         return await callback.answer(f"Hisobingizda mablag' yetarli emas! Kerak: {cost} {CURRENCY_SYMBOL}", show_alert=True)
     
-    expire_date = (datetime.datetime.now() + datetime.timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
+    expire_at = int(time.time()) + 30 * 86400
     
-    db_query("UPDATE users SET balance = balance - ?, status_level = ?, status_expire = ? WHERE id = ?", 
-             (cost, lvl, expire_date, callback.from_user.id), commit=True)
+    try:
+        await move_balance(debits=[(callback.from_user.id, cost)], status=(callback.from_user.id, lvl, expire_at),
+                           events=[("status", 1, cost)])
+    except InsufficientFunds:
+        return await callback.answer(f"Hisobingizda mablag' yetarli emas! Kerak: {cost} {CURRENCY_SYMBOL}", show_alert=True)
     
     await callback.message.delete()
     await callback.message.answer(f"🎉 **Tabriklaymiz!**\nSiz **{STATUS_DATA[lvl]['name']}** statusini sotib oldingiz!\nBarcha imkoniyatlar ochildi.")
 
 @dp.message(F.text == "🏆 Top Foydalanuvchilar")
 async def top_users(message: types.Message):
-    users = db_query("SELECT id, balance, status_level FROM users ORDER BY balance DESC LIMIT 10", fetchall=True)
+    users = await leaderboard.top()
     msg = f"🏆 **{CURRENCY_NAME} MILLIONERLARI:**\n\n"
     
     for idx, (uid, bal, lvl) in enumerate(users, 1):
@@ -433,88 +1962,168 @@ async def top_users(message: types.Message):
         # ID ni qisman yashirish (Professionalism)
         hidden_id = str(uid)[:4] + "..." + str(uid)[-2:]
         msg += f"{idx}. {badge} ID: `{hidden_id}` — **{format_num(bal)} {CURRENCY_SYMBOL}**\n"
+    
+    my_rank = await leaderboard.rank(message.from_user.id)
+    if my_rank: msg += f"\n📍 Sizning o'rningiz: **#{my_rank}**"
         
     await message.answer(msg, parse_mode="Markdown")
 
+# --- REFERALLARIM ---
+
+@dp.message(F.text == "👥 Referallarim")
+async def my_referrals(message: types.Message):
+    level1, level2, level3, earned = await get_referral_stats(message.from_user.id)
+    prices = get_dynamic_prices()
+    bot_username = (await bot.me()).username
+    
+    msg = (f"👥 **Referallarim**\n\n"
+           f"👤 Siz taklif qilganlar: **{level1}** ta\n")
+    if prices['ref_reward_2'] > 0 or level2:
+        msg += f"👥 2-daraja: **{level2}** ta (+{format_num(prices['ref_reward_2'])} {CURRENCY_SYMBOL} har biri)\n"
+    if prices['ref_reward_3'] > 0 or level3:
+        msg += f"👥 3-daraja: **{level3}** ta (+{format_num(prices['ref_reward_3'])} {CURRENCY_SYMBOL} har biri)\n"
+    msg += (f"💰 Jami ishlangan: **{format_num(earned)} {CURRENCY_SYMBOL}**\n\n"
+            f"🔗 Havolangiz:\n`https://t.me/{bot_username}?start={message.from_user.id}`")
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🏆 Top referallar", callback_data="ref_top")]])
+    await message.answer(msg, reply_markup=kb, parse_mode="Markdown")
+
+@dp.callback_query(F.data == "ref_top")
+async def referral_top(callback: types.CallbackQuery):
+    rows = await top_referrers()
+    msg = "🏆 **ENG KO'P TAKLIF QILGANLAR:**\n\n"
+    for idx, (uid, invited, earned) in enumerate(rows, 1):
+        hidden_id = str(uid)[:4] + "..." + str(uid)[-2:]
+        msg += f"{idx}. ID: `{hidden_id}` — **{invited}** ta ({format_num(earned)} {CURRENCY_SYMBOL})\n"
+    if not rows: msg += "Hozircha hech kim taklif qilmagan."
+    await callback.message.answer(msg, parse_mode="Markdown")
+    await callback.answer()
+
 # --- AKKOUNTLAR (LOYIHALAR) --- (Faqat tasdiqlangan akkountlarni ko'rsatish)
 @dp.message(F.text == "📂 Akkountlar")
 async def show_projects(message: types.Message):
-    projs = db_query("SELECT id, name FROM projects WHERE is_approved = 1", fetchall=True)
-    if not projs: return await message.answer("📂 Hozircha akkountlar yuklanmagan.") 
-    
-    kb = []
-    for pid, name in projs:
-        kb.append([InlineKeyboardButton(text=f"📁 {name} Akkounti", callback_data=f"view_proj_{pid}")]) 
-    await message.answer("📥 Kerakli akkountni tanlang va yuklab oling:", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    text, kb = await catalog.render("user", "a", "n", 0)
+    await message.answer(text, reply_markup=kb)
+
+@dp.callback_query(F.data.startswith("cat:"))
+async def catalog_page(callback: types.CallbackQuery):
+    _, scope, direction, cursor = callback.data.split(":")
+    if scope != "a": return await callback.answer() # Foydalanuvchiga faqat sotuvdagilar
+    text, kb = await catalog.render("user", scope, direction, int(cursor))
+    await callback.message.edit_text(text, reply_markup=kb)
+    await callback.answer()
 
-@dp.callback_query(F.data.startswith("view_proj_"))
-async def view_project(callback: types.CallbackQuery):
-    pid = int(callback.data.split("_")[-1])
-    proj = db_query("SELECT name, price, description, media_id, media_type, seller_id FROM projects WHERE id = ?", (pid,), fetchone=True)
-    
-    if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True) 
-    name, price, desc, mid, mtype, seller_id = proj
-    
-    user = get_user_data(callback.from_user.id)
-    discount = 0
-    if user['level'] == 2: discount = 0.5
-    elif user['level'] == 3: discount = 1.0
-    
-    final_price = price * (1 - discount)
-    
-    price_text = f"{format_num(price)} {CURRENCY_SYMBOL}"
-    if discount > 0:
-        price_text = f"~{format_num(price)}~ -> **{format_num(final_price)} {CURRENCY_SYMBOL}**"
-        if final_price == 0: price_text = "**TEKIN (Status)**"
-    
-    caption = f"📂 **{name} Akkounti**\n\n📝 {desc}\n\n💰 Narxi: {price_text}"
-    if seller_id: caption += f"\n\n👤 Sotuvchi ID: `{seller_id}`" # Sotuvchi ID ko'rsatildi
-    
-    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📥 Sotib olish / Yuklash", callback_data=f"buy_proj_{pid}")]])
+async def send_project_card(chat_id, user_id, pid):
+    # Akkount topilmasa (yoki foydalanuvchi uchun hali tasdiqlanmagan bo'lsa) False
+    user = await get_user_data(user_id)
+    card = await project_cards.get(pid, discount_for_level(user['level'] if user else 0))
+    if not card: return False
+    caption, kb, mid, mtype, is_approved = card
+    if is_approved != 1 and user_id != ADMIN_ID: return False
     
     try:
         if mid:
             if mtype == 'video':
-                await bot.send_video(callback.message.chat.id, mid, caption=caption, reply_markup=kb, parse_mode="Markdown")
+                await bot.send_video(chat_id, mid, caption=caption, reply_markup=kb, parse_mode="Markdown")
             elif mtype == 'photo':
-                await bot.send_photo(callback.message.chat.id, mid, caption=caption, reply_markup=kb, parse_mode="Markdown")
+                await bot.send_photo(chat_id, mid, caption=caption, reply_markup=kb, parse_mode="Markdown")
             else:
-                await callback.message.answer(caption, reply_markup=kb, parse_mode="Markdown")
+                await bot.send_message(chat_id, caption, reply_markup=kb, parse_mode="Markdown")
         else:
-            await callback.message.answer(caption, reply_markup=kb, parse_mode="Markdown")
+            await bot.send_message(chat_id, caption, reply_markup=kb, parse_mode="Markdown")
     except Exception as e:
         # Fayl yuborishda xato bo'lsa (Masalan, fayl_id noto'g'ri bo'lsa)
-        await callback.message.answer(caption, reply_markup=kb, parse_mode="Markdown")
+        await bot.send_message(chat_id, caption, reply_markup=kb, parse_mode="Markdown")
+    return True
+
+@dp.callback_query(F.data.startswith("view_proj_"))
+async def view_project(callback: types.CallbackQuery):
+    pid = int(callback.data.split("_")[-1])
+    if not await send_project_card(callback.message.chat.id, callback.from_user.id, pid):
+        return await callback.answer("Akkount topilmadi.", show_alert=True)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("buy_proj_"))
+# --- AKKOUNTLARNI QIDIRISH ---
+
+def search_results_kb(rows, offset, next_offset, page_size):
+    kb = [[InlineKeyboardButton(text=f"📁 {name} Akkounti — {format_num(price)} {CURRENCY_SYMBOL}", callback_data=f"view_proj_{pid}")]
+          for pid, name, price, _, _ in rows]
+    nav = []
+    if offset > 0: nav.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"srch:{max(0, offset - page_size)}"))
+    if next_offset is not None: nav.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"srch:{next_offset}"))
+    if nav: kb.append(nav)
+    kb.append([InlineKeyboardButton(text="🔎 Yangi qidiruv", callback_data="psearch")])
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+@dp.callback_query(F.data == "psearch")
+async def search_start(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.answer("🔎 Akkount nomi yoki tavsifidan so'z yozing.\n\n"
+                                  "ℹ️ Narx bo'yicha filtr: `<100`, `>20`, `20-100`", reply_markup=cancel_kb(), parse_mode="Markdown")
+    await state.set_state(CatalogSearch.waiting_for_query)
+    await callback.answer()
+
+@dp.message(CatalogSearch.waiting_for_query, F.text, flags={"throttle": "search"})
+async def search_query(message: types.Message, state: FSMContext):
+    # So'rov FSM ma'lumotida qoladi (sahifalash uchun), holat esa tozalanadi - menyu odatdagidek ishlaydi
+    await state.set_state(None)
+    await state.update_data(search_query=message.text)
+    rows, next_offset = await project_search.search(message.text, 0, catalog.page_size, admin=message.from_user.id == ADMIN_ID)
+    await message.answer("✅ Qidiruv tugadi.", reply_markup=main_menu(message.from_user.id))
+    if not rows: return await message.answer("📂 Hech narsa topilmadi.", reply_markup=search_results_kb([], 0, None, catalog.page_size))
+    await message.answer(f"🔎 Natijalar: {message.text}", reply_markup=search_results_kb(rows, 0, next_offset, catalog.page_size))
+
+@dp.callback_query(F.data.startswith("srch:"), flags={"throttle": "search"})
+async def search_page(callback: types.CallbackQuery, state: FSMContext):
+    text = (await state.get_data()).get("search_query")
+    if text is None: return await callback.answer("Qidiruv eskirgan, qaytadan qidiring.", show_alert=True)
+    offset = int(callback.data.split(":")[1])
+    rows, next_offset = await project_search.search(text, offset, catalog.page_size, admin=callback.from_user.id == ADMIN_ID)
+    await callback.message.edit_text(f"🔎 Natijalar: {text}", reply_markup=search_results_kb(rows, offset, next_offset, catalog.page_size))
+    await callback.answer()
+
+@dp.inline_query(flags={"throttle": "search"})
+async def inline_search(query: types.InlineQuery):
+    # Telegram natijalarni o'zi keshlaydi (cache_time); admin so'rovlari shaxsiy (holat filtrlari)
+    admin = query.from_user.id == ADMIN_ID
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    rows, next_offset = await project_search.search(query.query, offset, SEARCH_INLINE_PAGE_SIZE, admin=admin)
+    bot_username = (await bot.me()).username
+    results = []
+    for pid, name, price, desc, is_approved in rows:
+        status = f"{CATALOG_STATUS_EMOJI.get(is_approved, '❌')} " if admin else ""
+        kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="📥 Ko'rish / Sotib olish",
+                                                                         url=f"https://t.me/{bot_username}?start=proj_{pid}")]])
+        results.append(InlineQueryResultArticle(
+            id=str(pid), title=f"{status}{name} Akkounti", description=f"{format_num(price)} {CURRENCY_SYMBOL} · {(desc or '')[:80]}",
+            input_message_content=InputTextMessageContent(message_text=f"📂 {name} Akkounti\n\n📝 {desc}\n\n💰 Narxi: {format_num(price)} {CURRENCY_SYMBOL}"),
+            reply_markup=kb))
+    await query.answer(results, cache_time=30, is_personal=admin, next_offset=str(next_offset) if next_offset is not None else "")
+
+@dp.callback_query(F.data.startswith("buy_proj_"), flags={"throttle": "purchase"})
 async def buy_project_process(callback: types.CallbackQuery):
     pid = int(callback.data.split("_")[-1])
-    proj = db_query("SELECT price, file_id, name, seller_id FROM projects WHERE id = ?", (pid,), fetchone=True)
-    if not proj: return
+    proj = await db_query("SELECT price, file_id, name, seller_id FROM projects WHERE id = ? AND is_approved = 1", (pid,), fetchone=True)
+    if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True)
     price, file_id, name, seller_id = proj
     
-    user = get_user_data(callback.from_user.id)
-    discount = 0
-    if user['level'] == 2: discount = 0.5
-    elif user['level'] == 3: discount = 1.0
-    
-    final_price = price * (1 - discount)
+    user = await get_user_data(callback.from_user.id)
+    final_price = price * (1 - discount_for_level(user['level']))
     
     if user['balance'] < final_price:
         return await callback.answer(f"Mablag' yetarli emas! Kerak: {format_num(final_price)} {CURRENCY_SYMBOL}", show_alert=True)
         
     if final_price > 0:
-        db_query("UPDATE users SET balance = balance - ? WHERE id = ?", (final_price, callback.from_user.id), commit=True)
+        # Xaridordan yechish va sotuvchiga to'liq narxni berish (Komissiya emas!) - bitta tranzaksiyada
+        reward_amount = final_price # To'liq narx
+        credits = [(seller_id, reward_amount)] if seller_id else []
+        # Sotuvchiga xabar pul bilan bitta tranzaksiyada outboxga yoziladi
+        notices = [(seller_id, f"🎉 Akkountingiz sotildi (ID: {pid})! +{format_num(reward_amount)} {CURRENCY_SYMBOL} hisobingizga tushdi.", None)] if seller_id else []
+        try:
+            await move_balance(debits=[(callback.from_user.id, final_price)], credits=credits,
+                               events=[("project_sale", 1, final_price)], notices=notices)
+        except InsufficientFunds:
+            return await callback.answer(f"Mablag' yetarli emas! Kerak: {format_num(final_price)} {CURRENCY_SYMBOL}", show_alert=True)
         await callback.message.answer(f"✅ Xarid amalga oshdi! Hisobdan {format_num(final_price)} {CURRENCY_SYMBOL} yechildi.")
-        
-        # Sotuvchiga to'liq narxni berish (Komissiya emas!)
-        if seller_id and final_price > 0:
-            reward_amount = final_price # To'liq narx
-            db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (reward_amount, seller_id), commit=True)
-            try:
-                await bot.send_message(seller_id, f"🎉 Akkountingiz sotildi (ID: {pid})! +{format_num(reward_amount)} {CURRENCY_SYMBOL} hisobingizga tushdi.")
-            except: pass
             
     await bot.send_document(callback.message.chat.id, file_id, caption=f"✅ **{name} Akkounti**\n\nFaylni muvaffaqiyatli yuklab oldingiz!")
     await callback.answer()
@@ -524,23 +2133,26 @@ async def buy_project_process(callback: types.CallbackQuery):
 
 @dp.message(F.text == "💎 UC Sotib olish")
 async def uc_buy_start(message: types.Message, state: FSMContext):
-    packages = db_query("SELECT id, uc_amount, uzs_price, usd_price FROM uc_packages ORDER BY uc_amount ASC", fetchall=True)
+    packages = await uc_packages.get()
     if not packages: return await message.answer("⚠️ Hozircha UC to'plamlari yuklanmagan. Admin panelini tekshiring.")
     
+    msg, kb = screens.get("uc_packages", (uc_packages.version,), lambda: _build_uc_list(packages))
+    await message.answer(msg, reply_markup=kb, parse_mode="Markdown")
+    await state.set_state(UcOrder.choosing_uc)
+
+def _build_uc_list(packages):
     kb = []
     msg = f"💎 **UC To'plamlarini Tanlang:**\n\n"
     
     for pid, uc_amt, uzs_p, usd_p in packages:
         msg += f"🔥 **{uc_amt} UC**\n💰 Narxi: **{uzs_p:,.0f} UZS** / **{usd_p:.2f} USD**\n\n"
         kb.append([InlineKeyboardButton(text=f"{uc_amt} UC", callback_data=f"uc_buy:{pid}")])
-        
-    await message.answer(msg, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
-    await state.set_state(UcOrder.choosing_uc)
+    return msg, InlineKeyboardMarkup(inline_keyboard=kb)
 
-@dp.callback_query(F.data.startswith("uc_buy:"))
+@dp.callback_query(F.data.startswith("uc_buy:"), flags={"throttle": "purchase"})
 async def uc_buy_select(callback: types.CallbackQuery, state: FSMContext):
     pid = int(callback.data.split(":")[1])
-    package = db_query("SELECT uc_amount, uzs_price, usd_price FROM uc_packages WHERE id = ?", (pid,), fetchone=True)
+    package = await get_uc_package(pid)
     if not package: return await callback.answer("To'plam topilmadi.", show_alert=True)
     
     uc_amount, uzs_price, usd_price = package
@@ -552,48 +2164,33 @@ async def uc_buy_select(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(UcOrder.waiting_for_id)
     await callback.answer()
 
-@dp.message(UcOrder.waiting_for_id)
+@dp.message(UcOrder.waiting_for_id, flags={"throttle": "purchase"})
 async def uc_buy_confirm(message: types.Message, state: FSMContext):
     player_id = message.text.strip()
     if not player_id.isdigit(): 
         return await message.answer("⚠️ Iltimos, faqat raqamlardan iborat to'g'ri PUBG ID kiriting!")
 
     data = await state.get_data()
+    order_id = await orders.create("uc", message.from_user.id, None,
+                                   {"uc_amount": data['uc_amount'], "uzs_price": data['uzs_price'], "usd_price": data['usd_price'],
+                                    "player_id": player_id, "username": message.from_user.username})
     
-    admin_message = (f"🎮 **YANGI UC BUYURTMA!**\n"
+    admin_message = (f"🎮 **YANGI UC BUYURTMA!** (#{order_id})\n"
                      f"👤 User: ID `{message.from_user.id}` (@{message.from_user.username or 'yoq'})\n"
                      f"💰 UC Miqdori: **{data['uc_amount']} UC**\n"
                      f"💳 Narxi: **{data['uzs_price']:,.0f} UZS** / **{data['usd_price']:.2f} USD**\n"
                      f"🎯 PUBG ID: `{player_id}`")
                      
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ UC ni Jo'natdim", callback_data=f"uc_sent:{message.from_user.id}:{data['uc_amount']}"),
-         InlineKeyboardButton(text="❌ Rad etish", callback_data=f"uc_reject:{message.from_user.id}")]
+        [InlineKeyboardButton(text="✅ UC ni Jo'natdim", callback_data=f"ord:ok:{order_id}"),
+         InlineKeyboardButton(text="❌ Rad etish", callback_data=f"ord:no:{order_id}")]
     ])
 
-    await bot.send_message(ADMIN_ID, admin_message, reply_markup=kb, parse_mode="Markdown")
+    await orders.attach(order_id, await bot.send_message(ADMIN_ID, admin_message, reply_markup=kb, parse_mode="Markdown"))
     
     await message.answer("✅ Buyurtmangiz qabul qilindi. Tez orada admin UC ni hisobingizga yuklaydi!", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
-@dp.callback_query(F.data.startswith("uc_sent:"))
-async def uc_sent_approve(callback: types.CallbackQuery):
-    parts = callback.data.split(":")
-    uid, uc_amt = int(parts[1]), int(parts[2])
-    
-    try:
-        await bot.send_message(uid, f"✅ **UC Muvaffaqiyatli Yuklandi!**\nHisobingizga {uc_amt} UC qo'shildi.")
-    except: pass
-    await callback.message.edit_text(callback.message.text + "\n\n✅ UC YUKLANDI. TASDIQLANDI.")
-
-@dp.callback_query(F.data.startswith("uc_reject:"))
-async def uc_sent_reject(callback: types.CallbackQuery):
-    uid = int(callback.data.split(":")[1])
-    try:
-        await bot.send_message(uid, "❌ UC buyurtmangiz rad etildi. Iltimos, admin bilan bog'laning (ID xato bo'lishi mumkin).")
-    except: pass
-    await callback.message.edit_text(callback.message.text + "\n\n❌ RAD ETILDI.")
-
 # --- PUL O'TKAZISH --- (O'zgarishsiz)
 # ...
 
@@ -611,11 +2208,11 @@ async def transfer_id(message: types.Message, state: FSMContext):
     if rid == message.from_user.id:
         return await message.answer("⚠️ O'zingizga pul o'tkaza olmaysiz!")
 
-    if not db_query("SELECT id FROM users WHERE id = ?", (rid,), fetchone=True):
+    if not await db_query("SELECT id FROM users WHERE id = ?", (rid,), fetchone=True):
         return await message.answer("⚠️ Bunday ID ga ega foydalanuvchi topilmadi!")
         
     await state.update_data(rid=rid)
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     limit = STATUS_DATA[user['level']]['limit']
     
     await message.answer(f"💰 Qancha **{CURRENCY_NAME}** o'tkazmoqchisiz?\n"
@@ -623,7 +2220,7 @@ async def transfer_id(message: types.Message, state: FSMContext):
                          f"O'tkazma limiti: {limit} {CURRENCY_SYMBOL}", reply_markup=cancel_kb())
     await state.set_state(MoneyTransfer.waiting_for_amount)
 
-@dp.message(MoneyTransfer.waiting_for_amount)
+@dp.message(MoneyTransfer.waiting_for_amount, flags={"throttle": "purchase"})
 async def transfer_amount(message: types.Message, state: FSMContext):
     try:
         amount = float(message.text)
@@ -632,7 +2229,7 @@ async def transfer_amount(message: types.Message, state: FSMContext):
         
     if amount <= 0: return await message.answer("⚠️ Miqdor musbat bo'lishi kerak!")
     
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     limit = STATUS_DATA[user['level']]['limit']
     
     if amount > limit:
@@ -644,19 +2241,20 @@ async def transfer_amount(message: types.Message, state: FSMContext):
     data = await state.get_data()
     rid = data['rid']
     
-    db_query("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, message.from_user.id), commit=True)
-    db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, rid), commit=True)
+    try:
+        await move_balance(debits=[(message.from_user.id, amount)], credits=[(rid, amount)], events=[("transfer", 1, amount)],
+                           notices=[(rid, f"📥 **Sizga pul kelib tushdi!**\n+{format_num(amount)} {CURRENCY_SYMBOL}\nKimdan: ID `{message.from_user.id}`", None)])
+    except InsufficientFunds:
+        return await message.answer("⚠️ Hisobingizda yetarli mablag' yo'q!")
     
     await message.answer(f"✅ **Muvaffaqiyatli!**\n`{rid}` ID ga {format_num(amount)} {CURRENCY_SYMBOL} o'tkazildi.", reply_markup=main_menu(message.from_user.id))
-    try: await bot.send_message(rid, f"📥 **Sizga pul kelib tushdi!**\n+{format_num(amount)} {CURRENCY_SYMBOL}\nKimdan: ID `{message.from_user.id}`")
-    except: pass
     await state.clear()
 
 # --- YANGI: HAMKORLIK FUNKSIYALARI ---
 
 @dp.message(F.text == "🤝 Hamkorlik")
 async def partnership_menu(message: types.Message):
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     prices = get_dynamic_prices()
     
     msg = (f"🤝 **AKKOUNT SOTISH HAMKORLIGI (DEVELOPER STATUS):**\n\n"
@@ -680,7 +2278,7 @@ async def partnership_menu(message: types.Message):
 
 @dp.callback_query(F.data == "user_add_proj")
 async def user_add_proj_start(callback: types.CallbackQuery, state: FSMContext):
-    user = get_user_data(callback.from_user.id)
+    user = await get_user_data(callback.from_user.id)
     if user['level'] < 4: 
         return await callback.answer("Faqat Developer statusdagilar uchun!", show_alert=True)
         
@@ -732,10 +2330,11 @@ async def user_add_p_file(message: types.Message, state: FSMContext):
     data = await state.get_data()
     
     # Baza qo'shish (is_approved=0 - kutilmoqda)
-    db_query("INSERT INTO projects (name, price, description, media_id, media_type, file_id, seller_id, is_approved) VALUES (?,?,?,?,?,?,?,?)",
+    await db_query("INSERT INTO projects (name, price, description, media_id, media_type, file_id, seller_id, is_approved) VALUES (?,?,?,?,?,?,?,?)",
              (data['name'], data['price'], data['desc'], data['mid'], data['mtype'], message.document.file_id, message.from_user.id, 0), commit=True)
     
-    last_id = db_query("SELECT id FROM projects ORDER BY id DESC LIMIT 1", fetchone=True)[0]
+    last_id = (await db_query("SELECT id FROM projects ORDER BY id DESC LIMIT 1", fetchone=True))[0]
+    catalog.invalidate() # Admin ro'yxatida kutilayotganlar ko'rinadi
     
     admin_msg = (f"🔥 **YANGI AKKOUNT QO'SHISH SO'ROVI!**\n"
                  f"👤 Sotuvchi ID: `{message.from_user.id}` (@{message.from_user.username or 'yoq'})\n"
@@ -761,39 +2360,43 @@ async def user_add_p_file(message: types.Message, state: FSMContext):
 
 # --- ADMIN: AKKOUNT TASDIQLASH / RAD ETISH --- (O'zgarishsiz)
 
-@dp.callback_query(F.data.startswith("adm_proj_app:"))
-async def adm_proj_approve(callback: types.CallbackQuery):
+def _tx_review_project(conn, pid, approve):
+    # Holat o'zgarishi va sotuvchiga xabar - bitta birlik. Akkount topilmasa False
+    row = conn.execute("UPDATE projects SET is_approved = ? WHERE id = ? RETURNING seller_id, name",
+                       (1 if approve else -1, pid)).fetchone() # -1: rad etilgan (kerak bo'lsa butunlay o'chirish mumkin)
+    if row is None: return False
+    seller_id, name = row
+    if seller_id:
+        text = (f"✅ Tabriklaymiz! Sizning **{name}** akkountingiz botda sotuvga chiqarildi! ID: `{pid}`" if approve else
+                f"❌ Afsuski, sizning **{name}** akkountingiz admin tomonidan rad etildi.")
+        _tx_enqueue(conn, [(seller_id, text, None)])
+    return True
+
+async def review_project(callback, approve):
+    if callback.from_user.id != ADMIN_ID: return
     pid = int(callback.data.split(":")[1])
-    proj = db_query("SELECT seller_id, name FROM projects WHERE id = ?", (pid,), fetchone=True)
-    if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True)
-    seller_id, name = proj
-    
-    db_query("UPDATE projects SET is_approved = 1 WHERE id = ?", (pid,), commit=True)
+    if not await db.transaction(_tx_review_project, pid, approve):
+        return await callback.answer("Akkount topilmadi.", show_alert=True)
+    outbox.wake()
+    catalog.invalidate()
+    project_cards.invalidate(pid)
     
-    await callback.message.edit_caption(callback.message.caption + "\n\n✅ AKKOUNT TASDIQLANDI. SOTUVGA CHIQARILDI.")
-    try:
-        await bot.send_message(seller_id, f"✅ Tabriklaymiz! Sizning **{name}** akkountingiz botda sotuvga chiqarildi! ID: `{pid}`")
-    except: pass
+    mark = "✅ AKKOUNT TASDIQLANDI. SOTUVGA CHIQARILDI." if approve else "❌ AKKOUNT RAD ETILDI."
+    await callback.message.edit_caption(caption=callback.message.caption + "\n\n" + mark)
+
+@dp.callback_query(F.data.startswith("adm_proj_app:"))
+async def adm_proj_approve(callback: types.CallbackQuery):
+    await review_project(callback, True)
 
 @dp.callback_query(F.data.startswith("adm_proj_rej:"))
 async def adm_proj_reject(callback: types.CallbackQuery):
-    pid = int(callback.data.split(":")[1])
-    proj = db_query("SELECT seller_id, name FROM projects WHERE id = ?", (pid,), fetchone=True)
-    if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True)
-    seller_id, name = proj
-
-    db_query("UPDATE projects SET is_approved = -1 WHERE id = ?", (pid,), commit=True) # Rad etilgan (kerak bo'lsa butunlay o'chirish mumkin)
-
-    await callback.message.edit_caption(callback.message.caption + "\n\n❌ AKKOUNT RAD ETILDI.")
-    try:
-        await bot.send_message(seller_id, f"❌ Afsuski, sizning **{name}** akkountingiz admin tomonidan rad etildi.")
-    except: pass
+    await review_project(callback, False)
 
 # --- PUL YECHIB OLISH FUNKSIYALARI (FAQAT DEVELOPER UCHUN) --- (O'zgarishsiz)
 
 @dp.callback_query(F.data == "withdraw_start")
 async def withdraw_start(callback: types.CallbackQuery, state: FSMContext):
-    user = get_user_data(callback.from_user.id)
+    user = await get_user_data(callback.from_user.id)
     if user['level'] < 4: 
         return await callback.answer("Faqat Developer statusdagilar pul yechib oladi!", show_alert=True)
         
@@ -808,13 +2411,13 @@ async def withdraw_card(message: types.Message, state: FSMContext):
         return await message.answer("⚠️ Iltimos, to'g'ri karta raqamini kiriting (16-19 raqam).")
         
     await state.update_data(card=card)
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     
     await message.answer(f"💰 Qancha **{CURRENCY_NAME}** yechib olmoqchisiz?\n"
                          f"Sizning balansingiz: {format_num(user['balance'])} {CURRENCY_SYMBOL}", reply_markup=cancel_kb())
     await state.set_state(Withdraw.waiting_for_amount)
 
-@dp.message(Withdraw.waiting_for_amount)
+@dp.message(Withdraw.waiting_for_amount, flags={"throttle": "purchase"})
 async def withdraw_amount(message: types.Message, state: FSMContext):
     try:
         amount = float(message.text)
@@ -823,55 +2426,126 @@ async def withdraw_amount(message: types.Message, state: FSMContext):
         
     if amount <= 0: return await message.answer("⚠️ Miqdor musbat bo'lishi kerak!")
     
-    user = get_user_data(message.from_user.id)
+    user = await get_user_data(message.from_user.id)
     if user['balance'] < amount:
         return await message.answer("⚠️ Hisobingizda yetarli mablag' yo'q!")
         
     data = await state.get_data()
     
-    # Balansdan yechib olish
-    db_query("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, message.from_user.id), commit=True)
+    # Balansdan yechib olish va buyurtma yaratish (tekshiruv bilan birga, atomik)
+    try:
+        order_id = await orders.create("withdraw", message.from_user.id, amount, {"card": data['card']}, debit=True)
+    except InsufficientFunds:
+        return await message.answer("⚠️ Hisobingizda yetarli mablag' yo'q!")
     
-    admin_message = (f"💸 **YANGI PUL YECHIB OLISH SO'ROVI!**\n"
+    admin_message = (f"💸 **YANGI PUL YECHIB OLISH SO'ROVI!** (#{order_id})\n"
                      f"👤 User: ID `{message.from_user.id}` (@{message.from_user.username or 'yoq'})\n"
                      f"💰 Miqdor: **{format_num(amount)} {CURRENCY_SYMBOL}**\n"
                      f"💳 Karta: `{data['card']}`\n\n"
                      f"❌ Admin Pulni {format_num(amount)} {CURRENCY_SYMBOL} yechib olganini tasdiqlash uchun pastdagi tugmani bosing.")
                      
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Pulni o'tkazdim va Tasdiqladim", callback_data=f"wd_ok:{message.from_user.id}:{amount}:{data['card']}"),
-         InlineKeyboardButton(text="❌ Rad etish (Balansni qaytarish)", callback_data=f"wd_no:{message.from_user.id}:{amount}")]
+        [InlineKeyboardButton(text="✅ Pulni o'tkazdim va Tasdiqladim", callback_data=f"ord:ok:{order_id}"),
+         InlineKeyboardButton(text="❌ Rad etish (Balansni qaytarish)", callback_data=f"ord:no:{order_id}")]
     ])
     
-    await bot.send_message(ADMIN_ID, admin_message, reply_markup=kb, parse_mode="Markdown")
+    await orders.attach(order_id, await bot.send_message(ADMIN_ID, admin_message, reply_markup=kb, parse_mode="Markdown"))
     
     await message.answer(f"✅ So'rovingiz adminga yuborildi. {format_num(amount)} {CURRENCY_SYMBOL} tez orada `{data['card']}` kartangizga o'tkaziladi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
-@dp.callback_query(F.data.startswith("wd_ok:"))
-async def withdraw_approve(callback: types.CallbackQuery):
-    parts = callback.data.split(":")
-    uid, amt, card = int(parts[1]), float(parts[2]), parts[3]
-    
-    # Pulni o'tkazganini tasdiqlash (bu yerda faqat xabar yuboriladi, balans oldin yechilgan)
-    try:
-        await bot.send_message(uid, f"✅ **Pulni Yechib Olish Tasdiqlandi!**\n{format_num(amt)} {CURRENCY_SYMBOL} `{card}` kartangizga o'tkazildi.")
-    except: pass
-    await callback.message.edit_text(callback.message.text + "\n\n✅ O'TKAZILDI VA TASDIQLANDI.")
+# --- ADMIN: BUYURTMALARNI KO'RIB CHIQISH ---
+ORDER_MARKS = {("uc", True): "✅ UC YUKLANDI. TASDIQLANDI.", ("uc", False): "❌ RAD ETILDI.",
+               ("topup", True): "✅ TASDIQLANDI", ("topup", False): "❌ RAD ETILDI",
+               ("withdraw", True): "✅ O'TKAZILDI VA TASDIQLANDI.", ("withdraw", False): "❌ RAD ETILDI. BALANS QAYTARILDI."}
+ORDER_FILTERS = (("all", "Hammasi"), ("uc", "UC"), ("topup", "To'lov"), ("withdraw", "Yechish"))
 
-@dp.callback_query(F.data.startswith("wd_no:"))
-async def withdraw_reject(callback: types.CallbackQuery):
-    parts = callback.data.split(":")
-    uid, amt = int(parts[1]), float(parts[2])
-    
-    # Balansni qaytarish
-    db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (amt, uid), commit=True)
-    
-    try:
-        await bot.send_message(uid, f"❌ Pul yechib olish rad etildi. Hisobingizga {format_num(amt)} {CURRENCY_SYMBOL} qaytarildi.")
-    except: pass
-    await callback.message.edit_text(callback.message.text + "\n\n❌ RAD ETILDI. BALANS QAYTARILDI.")
+@dp.callback_query(F.data.startswith("ord:"))
+async def order_decide(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    _, action, order_id = callback.data.split(":")
+    await _decide_from_message(callback, int(order_id), action == "ok")
+
+async def _decide_from_message(callback, order_id, approve):
+    rows = await orders.decide([order_id], approve, skip_message_id=callback.message.message_id)
+    if not rows:
+        # Ikkinchi bosish yoki navbatdan allaqachon hal qilingan
+        await callback.answer("Bu buyurtma allaqachon ko'rib chiqilgan.", show_alert=True)
+        try: await callback.message.edit_reply_markup(reply_markup=None)
+        except Exception: pass
+        return
+    mark = "\n\n" + ORDER_MARKS[(rows[0][1], approve)]
+    if callback.message.photo:
+        await callback.message.edit_caption(caption=callback.message.caption + mark)
+    else:
+        await callback.message.edit_text(callback.message.text + mark)
+    await callback.answer()
 
+# Buyurtmalar jadvalidan oldingi admin xabarlaridagi tugmalar: ma'lumot tugmaning o'zida
+# (wd_ok:<user>:<summa>:<karta>, p_ok:<user>:<summa>, uc_sent:<user>:<uc> ...). Ular shu xabarga
+# bog'langan buyurtmaga aylantiriladi va odatdagidek hal qilinadi (rad etilgan yechish - pul qaytadi).
+LEGACY_ORDER_ACTIONS = {"wd_ok": ("withdraw", True), "wd_no": ("withdraw", False), "p_ok": ("topup", True),
+                        "p_no": ("topup", False), "uc_sent": ("uc", True), "uc_reject": ("uc", False)}
+
+@dp.callback_query(F.data.regexp(r"^(wd_ok|wd_no|p_ok|p_no|uc_sent|uc_reject):"))
+async def legacy_order_decide(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    action, rest = callback.data.split(":", 1)
+    kind, approve = LEGACY_ORDER_ACTIONS[action]
+    parts = rest.split(":", 2)
+    user_id = int(parts[0])
+    if kind == "uc":
+        amount, details = None, {"uc_amount": int(parts[1]) if len(parts) > 1 else 0, "player_id": "?"}
+    elif kind == "topup":
+        amount, details = float(parts[1]) if len(parts) > 1 else 0.0, {"txt": "?", "curr": "?"}
+    else:
+        amount, details = float(parts[1]), {"card": parts[2] if len(parts) > 2 else "?"}
+    order_id = await orders.adopt(kind, user_id, amount, details, callback.message)
+    await _decide_from_message(callback, order_id, approve)
+
+def _order_line(order_id, kind, user_id, amount, details, created_at):
+    details = json.loads(details or "{}")
+    if kind == "uc": info = f"{details['uc_amount']} UC, PUBG ID {details['player_id']}"
+    elif kind == "topup": info = f"{format_num(amount)} {CURRENCY_SYMBOL} ({details['txt']})"
+    else: info = f"{format_num(amount)} {CURRENCY_SYMBOL}, karta {details['card']}"
+    minutes = max(0, int(time.time()) - created_at) // 60
+    return f"#{order_id} {ORDER_KINDS[kind]} · ID {user_id} · {info} · {minutes} daq oldin"
+
+async def render_order_queue(scope):
+    counts = await orders.pending_counts()
+    rows = await orders.pending(None if scope == "all" else scope)
+    lines = [f"📋 Kutilayotgan buyurtmalar: {sum(counts.values())} ta",
+             " | ".join(f"{label}: {counts.get(kind, 0)}" for kind, label in ORDER_KINDS.items()), ""]
+    lines += [_order_line(*row) for row in rows] or ["✅ Navbat bo'sh."]
+    kb = [[InlineKeyboardButton(text=("• " if key == scope else "") + label, callback_data=f"oq:{key}")
+           for key, label in ORDER_FILTERS]]
+    if rows:
+        # Faqat ko'rsatilgan buyurtmalar (id <= oxirgisi) hal qilinadi, keyin kelganlari tegilmaydi
+        last_id = rows[-1][0]
+        kb.append([InlineKeyboardButton(text=f"✅ {len(rows)} tasini tasdiqlash", callback_data=f"oqd:ok:{scope}:{last_id}"),
+                   InlineKeyboardButton(text=f"❌ {len(rows)} tasini rad etish", callback_data=f"oqd:no:{scope}:{last_id}")])
+    kb.append([InlineKeyboardButton(text="🔄 Yangilash", callback_data=f"oq:{scope}"),
+               InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")])
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=kb)
+
+@dp.callback_query(F.data.startswith("oq:"))
+async def adm_order_queue(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    text, kb = await render_order_queue(callback.data.split(":")[1])
+    try: await callback.message.edit_text(text, reply_markup=kb)
+    except Exception: pass # O'zgarmagan navbatni yangilash
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("oqd:"))
+async def adm_order_queue_decide(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    _, action, scope, last_id = callback.data.split(":")
+    pending = await orders.pending(None if scope == "all" else scope, upto_id=int(last_id))
+    rows = await orders.decide([row[0] for row in pending], action == "ok")
+    text, kb = await render_order_queue(scope)
+    try: await callback.message.edit_text(text, reply_markup=kb)
+    except Exception: pass
+    await callback.answer(f"{len(rows)} ta buyurtma {'tasdiqlandi' if action == 'ok' else 'rad etildi'}.")
 
 # --- ADMIN PANEL ---
 
@@ -887,10 +2561,163 @@ async def admin_panel(message: types.Message):
          InlineKeyboardButton(text="✏️ User Balansi", callback_data="adm_edit_bal")],
         [InlineKeyboardButton(text="📢 Broadcast (Xabar)", callback_data="adm_broadcast"),
          # UC Tahrirlash (YANGI)
-         InlineKeyboardButton(text="💎 UC To'plamlarini Boshqarish/Tahrir", callback_data="adm_manage_uc")]
+         InlineKeyboardButton(text="💎 UC To'plamlarini Boshqarish/Tahrir", callback_data="adm_manage_uc")],
+        [InlineKeyboardButton(text="📝 Matnlarni tahrirlash", callback_data="adm_texts"),
+         InlineKeyboardButton(text="📋 Buyurtmalar navbati", callback_data="oq:all")],
+        [InlineKeyboardButton(text="📤 Eksport", callback_data="adm_export")]
     ]
     await message.answer("🔐 **Admin Panel v3.1 (UC Servis)**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
 
+def _metrics_table(title, rows, limit=8):
+    if not rows: return f"{title}\n  (ma'lumot yo'q)"
+    lines = [title]
+    for label, count, avg, p50, p99 in rows[:limit]:
+        lines.append(f"  {label}: {count} ta, o'rt {avg * 1000:.1f}ms, p50≤{p50 * 1000:g}ms, p99≤{p99 * 1000:g}ms")
+    return "\n".join(lines)
+
+@dp.message(Command("metrics"))
+async def admin_metrics(message: types.Message):
+    if message.from_user.id != ADMIN_ID: return
+    stats = throttle.stats()
+    outbox_stats = await outbox.stats()
+    parts = [
+        "📈 Metrikalar (jarayon ishga tushganidan beri)",
+        _metrics_table("⚙️ Handlerlar:", metrics.summary("bot_handler_seconds", "handler")),
+        f"  Xatoliklar: {metrics.counter('bot_handler_errors_total')}",
+        _metrics_table("🗄 Baza:", metrics.summary("bot_db_seconds", "statement")),
+        f"  Xatoliklar: {metrics.counter('bot_db_errors_total')}",
+        _metrics_table("📡 Telegram API:", metrics.summary("bot_api_seconds", "method")),
+        f"  RetryAfter: {metrics.counter('bot_api_retry_after_total')} marta, "
+        f"{metrics.counter('bot_api_retry_after_seconds_total')}s kutish; xatoliklar: {metrics.counter('bot_api_errors_total')}",
+        f"🛡 Anti-spam: o'tdi {stats['passed']}, to'xtatildi {stats['throttled']}, faol bucketlar {stats['active_buckets']}",
+        f"📬 Outbox: kutilmoqda {outbox_stats.get('pending', 0)}, yetkazilmadi (dead) {outbox_stats.get('dead', 0)}",
+        f"🧩 Ekranlar keshi: topildi {screens.hits}, qurildi {screens.misses}",
+    ]
+    await message.answer("\n\n".join(parts))
+
+@dp.message(Command("stats"))
+async def admin_stats(message: types.Message):
+    if message.from_user.id != ADMIN_ID: return
+    windows = await stats_windows()
+    parts = ["📊 **Statistika**"]
+    for w, title in ((1, "📅 Bugun"), (7, "🗓 Oxirgi 7 kun"), (30, "🗓 Oxirgi 30 kun")):
+        lines = [f"**{title}:**"]
+        for metric, name in STATS_METRICS.items():
+            count, amount = windows[w].get(metric, (0, 0.0))
+            if metric in ("new_user", "uc"): lines.append(f"{name}: {count}") # UC buyurtmalarida summa yo'q
+            else: lines.append(f"{name}: {count} ta, {format_num(amount)} {CURRENCY_SYMBOL}")
+        parts.append("\n".join(lines))
+    await message.answer("\n\n".join(parts), parse_mode="Markdown")
+
+# --- ADMIN: EKSPORT (CSV / JSONL) ---
+# Jadval alohida read-only ulanishda kursor orqali bo'laklab o'qiladi va gzip faylga oqim bilan
+# yoziladi - xotirada bir vaqtning o'zida faqat bitta bo'lak turadi. Eksport fonda ishlaydi,
+# tayyor fayl adminga hujjat qilib yuboriladi.
+EXPORT_TABLES = {"users": "👤 Foydalanuvchilar", "projects": "🛒 Akkountlar", "orders": "📋 Buyurtmalar"}
+EXPORT_FORMATS = ("csv", "jsonl")
+# Bot API oddiy serverda 50 MB gacha, lokal Bot API serverda 2000 MB gacha fayl qabul qiladi
+EXPORT_MAX_BYTES = (2000 if TELEGRAM_API_URL else 50) * 1024 * 1024
+
+class Exporter:
+    def __init__(self, chunk_size=5000):
+        self.chunk_size = chunk_size
+        self._tasks = {}
+
+    def _write(self, table, fmt, path):
+        # Thread ichida bajariladi. Qaytaradi: yozilgan qatorlar soni
+        conn = sqlite3.connect(f"file:{db.path}?mode=ro", uri=True, timeout=30)
+        rows = 0
+        try:
+            cursor = conn.execute(f"SELECT * FROM {table} ORDER BY rowid")
+            columns = [c[0] for c in cursor.description]
+            with gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="") as out:
+                writer = csv.writer(out) if fmt == "csv" else None
+                if writer: writer.writerow(columns)
+                while True:
+                    chunk = cursor.fetchmany(self.chunk_size)
+                    if not chunk: break
+                    if writer:
+                        writer.writerows(chunk)
+                    else:
+                        out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in chunk)
+                    rows += len(chunk)
+        finally:
+            conn.close()
+        return rows
+
+    def running(self, table, fmt):
+        task = self._tasks.get((table, fmt))
+        return task is not None and not task.done()
+
+    def start(self, table, fmt, chat_id):
+        key = (table, fmt)
+        task = self._tasks[key] = asyncio.create_task(self._run(table, fmt, chat_id))
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return task
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task: del self._tasks[key]
+
+    async def _run(self, table, fmt, chat_id):
+        filename = f"{table}_{time.strftime('%Y%m%d_%H%M%S')}.{fmt}.gz"
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+        os.close(fd)
+        started = time.perf_counter()
+        try:
+            rows = await asyncio.to_thread(self._write, table, fmt, path)
+            size = os.path.getsize(path)
+            if size > EXPORT_MAX_BYTES:
+                await bot.send_message(chat_id, f"⚠️ {filename} juda katta ({size / 1024 / 1024:.1f} MB), yuborib bo'lmadi.")
+                return
+            await bot.send_document(chat_id, FSInputFile(path, filename=filename),
+                                    caption=f"📤 {EXPORT_TABLES[table]}: {rows} qator ({size / 1024:.0f} KB)")
+            logging.info(f"Eksport {filename}: {rows} qator, {size} bayt, {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            logging.error(f"Eksport xatoligi ({table}.{fmt}): {e}")
+            try: await bot.send_message(chat_id, f"❌ Eksport xatoligi ({table}.{fmt}): {e}")
+            except Exception: pass
+        finally:
+            try: os.remove(path)
+            except OSError: pass
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks: task.cancel()
+        if tasks: await asyncio.gather(*tasks, return_exceptions=True)
+
+exporter = Exporter(chunk_size=int(os.getenv("EXPORT_CHUNK_SIZE", "5000")))
+
+def export_kb():
+    kb = [[InlineKeyboardButton(text=f"{name} ({fmt.upper()})", callback_data=f"exp:{table}:{fmt}") for fmt in EXPORT_FORMATS]
+          for table, name in EXPORT_TABLES.items()]
+    return InlineKeyboardMarkup(inline_keyboard=kb)
+
+@dp.message(Command("export"))
+async def admin_export(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_ID: return
+    args = (command.args or "").split()
+    if len(args) == 2 and args[0] in EXPORT_TABLES and args[1] in EXPORT_FORMATS:
+        if exporter.running(*args): return await message.answer("⏳ Bu eksport allaqachon tayyorlanmoqda.")
+        exporter.start(args[0], args[1], message.chat.id)
+        return await message.answer("⏳ Eksport boshlandi, tayyor bo'lgach fayl yuboriladi.")
+    await message.answer("📤 **Eksport uchun jadval va formatni tanlang:**", reply_markup=export_kb(), parse_mode="Markdown")
+
+@dp.callback_query(F.data == "adm_export")
+async def adm_export_menu(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    await callback.message.answer("📤 **Eksport uchun jadval va formatni tanlang:**", reply_markup=export_kb(), parse_mode="Markdown")
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("exp:"))
+async def adm_export_start(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    _, table, fmt = callback.data.split(":")
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS: return await callback.answer()
+    if exporter.running(table, fmt):
+        return await callback.answer("⏳ Bu eksport allaqachon tayyorlanmoqda.", show_alert=True)
+    exporter.start(table, fmt, callback.message.chat.id)
+    await callback.answer("⏳ Eksport boshlandi, tayyor bo'lgach fayl yuboriladi.", show_alert=True)
+
 @dp.callback_query(F.data == "adm_back_main")
 async def adm_back_main(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID: return
@@ -911,7 +2738,7 @@ async def adm_edit_bal_id(message: types.Message, state: FSMContext):
         return await message.answer("⚠️ Iltimos, faqat raqamlardan iborat ID kiriting!")
         
     user_id = int(message.text)
-    user_data = get_user_data(user_id)
+    user_data = await get_user_data(user_id)
     if user_data is None:
         return await message.answer("⚠️ Bunday ID ga ega foydalanuvchi topilmadi!")
 
@@ -919,6 +2746,11 @@ async def adm_edit_bal_id(message: types.Message, state: FSMContext):
     await message.answer(f"💰 **{user_id}** ID li foydalanuvchining joriy balansi: **{format_num(user_data['balance'])} {CURRENCY_SYMBOL}**\n\nYangi balans miqdorini kiriting:")
     await state.set_state(AdminState.edit_balance_amount)
 
+def _tx_set_balance(conn, user_id, balance, notice):
+    row = conn.execute("UPDATE users SET balance = ? WHERE id = ? RETURNING balance, status_level", (balance, user_id)).fetchone()
+    if row: _tx_enqueue(conn, [notice])
+    return row
+
 @dp.message(AdminState.edit_balance_amount)
 async def adm_edit_bal_amount(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID: return
@@ -930,12 +2762,14 @@ async def adm_edit_bal_amount(message: types.Message, state: FSMContext):
     data = await state.get_data()
     user_id = data['edit_user_id']
     
-    db_query("UPDATE users SET balance = ? WHERE id = ?", (new_balance, user_id), commit=True)
+    clicks.discard(user_id)
+    notice = (user_id, f"🚨 **ADMIN XABARI!**\nSizning balansingiz admin tomonidan **{format_num(new_balance)} {CURRENCY_SYMBOL}** ga tahrirlandi.", None)
+    row = await db.transaction(_tx_set_balance, user_id, new_balance, notice)
+    if row:
+        leaderboard.update(user_id, *row)
+        outbox.wake()
     
     await message.answer(f"✅ **{user_id}** ID li foydalanuvchi balansi **{format_num(new_balance)} {CURRENCY_SYMBOL}** ga tahrirlandi.", reply_markup=main_menu(message.from_user.id))
-    try:
-        await bot.send_message(user_id, f"🚨 **ADMIN XABARI!**\nSizning balansingiz admin tomonidan **{format_num(new_balance)} {CURRENCY_SYMBOL}** ga tahrirlandi.")
-    except: pass
     await state.clear()
 
 
@@ -997,8 +2831,9 @@ async def adm_p_file(message: types.Message, state: FSMContext):
     data = await state.get_data()
     
     # Admin qo'shgan akkount avtomatik tasdiqlanadi (is_approved=1)
-    db_query("INSERT INTO projects (name, price, description, media_id, media_type, file_id, is_approved) VALUES (?,?,?,?,?,?,?)",
+    await db_query("INSERT INTO projects (name, price, description, media_id, media_type, file_id, is_approved) VALUES (?,?,?,?,?,?,?)",
              (data['name'], data['price'], data['desc'], data['mid'], data['mtype'], message.document.file_id, 1), commit=True)
+    catalog.invalidate()
     
     # Loyiha -> Akkount
     await message.answer("✅ Akkount bazaga qo'shildi!", reply_markup=main_menu(message.from_user.id))
@@ -1011,25 +2846,22 @@ async def adm_p_file(message: types.Message, state: FSMContext):
 async def adm_manage_proj(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID: return
     # Tasdiqlangan va kutilayotgan akkountlarni ko'rsatish
-    projs = db_query("SELECT id, name, is_approved, seller_id FROM projects", fetchall=True)
-    if not projs: return await callback.message.edit_text("📂 Hozircha akkountlar mavjud emas.", reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")]]))
-    
-    kb = []
-    msg = "✏️ **Tahrirlash uchun Akkountni tanlang:**\n\n"
-    
-    for pid, name, is_approved, seller_id in projs:
-        status_emoji = "✅" if is_approved == 1 else ("⏳" if is_approved == 0 else "❌")
-        seller_info = f" (Sotuvchi: {seller_id})" if seller_id else ""
-        kb.append([InlineKeyboardButton(text=f"{status_emoji} [{pid}] {name} Akkounti{seller_info}", callback_data=f"edit_proj:{pid}")])
-        
-    kb.append([InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")])
-    await callback.message.edit_text(msg, reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
+    text, kb = await catalog.render("admin", "all", "n", 0)
+    await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+
+@dp.callback_query(F.data.startswith("acat:"))
+async def adm_catalog_page(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    _, scope, direction, cursor = callback.data.split(":")
+    text, kb = await catalog.render("admin", scope, direction, int(cursor))
+    await callback.message.edit_text(text, reply_markup=kb, parse_mode="Markdown")
+    await callback.answer()
 
 @dp.callback_query(F.data.startswith("edit_proj:"))
 async def adm_edit_proj_select(callback: types.CallbackQuery, state: FSMContext):
     if callback.from_user.id != ADMIN_ID: return
     pid = int(callback.data.split(":")[1])
-    proj = db_query("SELECT name, price, is_approved, seller_id FROM projects WHERE id = ?", (pid,), fetchone=True)
+    proj = await db_query("SELECT name, price, is_approved, seller_id FROM projects WHERE id = ?", (pid,), fetchone=True)
     if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True)
     
     name, price, is_approved, seller_id = proj
@@ -1041,17 +2873,20 @@ async def adm_edit_proj_select(callback: types.CallbackQuery, state: FSMContext)
     
     msg = f"**Akkount ID:** `{pid}`{seller_text}\n**Nomi:** {name}\n**Narxi:** {format_num(price)} {CURRENCY_SYMBOL}\n**Status:** {status_text}\n\nQaysi maydonni tahrirlamoqchisiz?"
     
-    # Tahrirlash tugmalariga qo'shimcha tasdiqlash tugmalari
-    dynamic_kb = edit_proj_kb(pid)
+    # Tahrirlash tugmalariga qo'shimcha tasdiqlash tugmalari (keshdagi edit_proj_kb o'zgartirilmaydi - yangi ro'yxat)
+    rows = list(edit_proj_kb(pid).inline_keyboard)
+    
+    if seller_id:
+        rows.insert(-1, [InlineKeyboardButton(text="👤 Sotuvchining barcha akkountlari", callback_data=f"acat:u{seller_id}:n:0")])
     
     if is_approved == 0:
         new_row = [
             InlineKeyboardButton(text="✅ So'rovni Tasdiqlash", callback_data=f"adm_proj_app:{pid}"),
             InlineKeyboardButton(text="❌ So'rovni Rad etish", callback_data=f"adm_proj_rej:{pid}")
         ]
-        dynamic_kb.inline_keyboard.insert(0, new_row)
+        rows.insert(0, new_row)
         
-    await callback.message.edit_text(msg, reply_markup=dynamic_kb, parse_mode="Markdown")
+    await callback.message.edit_text(msg, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows), parse_mode="Markdown")
 
 @dp.callback_query(F.data.startswith("ep_"))
 async def adm_edit_proj_fields(callback: types.CallbackQuery, state: FSMContext):
@@ -1061,12 +2896,14 @@ async def adm_edit_proj_fields(callback: types.CallbackQuery, state: FSMContext)
     await state.update_data(edit_pid=pid, edit_field=action)
     
     if action == "ep_delete":
-        db_query("DELETE FROM projects WHERE id = ?", (pid,), commit=True)
+        await db_query("DELETE FROM projects WHERE id = ?", (pid,), commit=True)
+        catalog.invalidate()
+        project_cards.invalidate(pid)
         await callback.answer(f"Akkount (ID: {pid}) o'chirildi.", show_alert=True)
         await adm_manage_proj(callback) 
         return
 
-    proj = db_query("SELECT name, price, description, media_id, file_id FROM projects WHERE id = ?", (pid,), fetchone=True)
+    proj = await db_query("SELECT name, price, description, media_id, file_id FROM projects WHERE id = ?", (pid,), fetchone=True)
     if not proj: return await callback.answer("Akkount topilmadi.", show_alert=True)
     name, price, desc, mid, fid = proj
 
@@ -1091,7 +2928,9 @@ async def adm_edit_proj_fields(callback: types.CallbackQuery, state: FSMContext)
 async def adm_save_proj_name(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID: return
     data = await state.get_data()
-    db_query("UPDATE projects SET name = ? WHERE id = ?", (message.text, data['edit_pid']), commit=True)
+    await db_query("UPDATE projects SET name = ? WHERE id = ?", (message.text, data['edit_pid']), commit=True)
+    project_cards.invalidate(data['edit_pid'])
+    catalog.invalidate()
     await message.answer("✅ Akkount nomi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1101,7 +2940,9 @@ async def adm_save_proj_price(message: types.Message, state: FSMContext):
     try: val = float(message.text)
     except: return await message.answer("⚠️ Iltimos, to'g'ri raqam kiriting.")
     data = await state.get_data()
-    db_query("UPDATE projects SET price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    await db_query("UPDATE projects SET price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    project_cards.invalidate(data['edit_pid'])
+    catalog.invalidate() # Qidiruv natijalari ham katalog versiyasiga bog'liq
     await message.answer("✅ Akkount narxi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1109,7 +2950,9 @@ async def adm_save_proj_price(message: types.Message, state: FSMContext):
 async def adm_save_proj_desc(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID: return
     data = await state.get_data()
-    db_query("UPDATE projects SET description = ? WHERE id = ?", (message.text, data['edit_pid']), commit=True)
+    await db_query("UPDATE projects SET description = ? WHERE id = ?", (message.text, data['edit_pid']), commit=True)
+    project_cards.invalidate(data['edit_pid'])
+    catalog.invalidate() # Qidiruv natijalari ham katalog versiyasiga bog'liq
     await message.answer("✅ Akkount tavsifi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1127,7 +2970,9 @@ async def adm_save_proj_media(message: types.Message, state: FSMContext):
         return await message.answer("⚠️ Iltimos, rasm, video yoki 'skip' yozing.")
 
     data = await state.get_data()
-    db_query("UPDATE projects SET media_id = ?, media_type = ? WHERE id = ?", (mid, mtype, data['edit_pid']), commit=True)
+    await db_query("UPDATE projects SET media_id = ?, media_type = ? WHERE id = ?", (mid, mtype, data['edit_pid']), commit=True)
+    project_cards.invalidate(data['edit_pid'])
+    catalog.invalidate() # Qidiruv natijalari ham katalog versiyasiga bog'liq
     await message.answer("✅ Akkount rasmi/videosi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1136,7 +2981,9 @@ async def adm_save_proj_file(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID: return
     if not message.document: return await message.answer("⚠️ Iltimos, fayl yuboring.")
     data = await state.get_data()
-    db_query("UPDATE projects SET file_id = ? WHERE id = ?", (message.document.file_id, data['edit_pid']), commit=True)
+    await db_query("UPDATE projects SET file_id = ? WHERE id = ?", (message.document.file_id, data['edit_pid']), commit=True)
+    project_cards.invalidate(data['edit_pid'])
+    catalog.invalidate() # Qidiruv natijalari ham katalog versiyasiga bog'liq
     await message.answer("✅ Akkount fayli tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1146,7 +2993,7 @@ async def adm_save_proj_file(message: types.Message, state: FSMContext):
 @dp.callback_query(F.data == "adm_manage_uc")
 async def adm_manage_uc(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID: return
-    packages = db_query("SELECT id, uc_amount, uzs_price, usd_price FROM uc_packages ORDER BY uc_amount ASC", fetchall=True)
+    packages = await uc_packages.get()
     
     msg = "💎 **UC To'plamlari (Qo'shish / Tahrirlash):**\n\n"
     kb_rows = []
@@ -1203,8 +3050,9 @@ async def adm_add_uc_usd(message: types.Message, state: FSMContext):
     
     data = await state.get_data()
     
-    db_query("INSERT INTO uc_packages (uc_amount, uzs_price, usd_price) VALUES (?, ?, ?)",
+    await db_query("INSERT INTO uc_packages (uc_amount, uzs_price, usd_price) VALUES (?, ?, ?)",
              (data['uc_amount'], data['uzs_price'], usd_p), commit=True)
+    uc_packages.invalidate()
              
     await message.answer(f"✅ **{data['uc_amount']} UC** to'plami bazaga qo'shildi!", reply_markup=main_menu(message.from_user.id))
     await state.clear()
@@ -1214,7 +3062,7 @@ async def adm_add_uc_usd(message: types.Message, state: FSMContext):
 async def adm_edit_uc_select(callback: types.CallbackQuery, state: FSMContext):
     if callback.from_user.id != ADMIN_ID: return
     pid = int(callback.data.split(":")[1])
-    pkg = db_query("SELECT uc_amount, uzs_price, usd_price FROM uc_packages WHERE id = ?", (pid,), fetchone=True)
+    pkg = await get_uc_package(pid)
     if not pkg: return await callback.answer("To'plam topilmadi.", show_alert=True)
     
     uc_amount, uzs_price, usd_price = pkg
@@ -1231,12 +3079,13 @@ async def adm_edit_uc_fields(callback: types.CallbackQuery, state: FSMContext):
     pid = int(pid)
     await state.update_data(edit_pid=pid, edit_field=action)
     
-    pkg = db_query("SELECT uc_amount, uzs_price, usd_price FROM uc_packages WHERE id = ?", (pid,), fetchone=True)
+    pkg = await get_uc_package(pid)
     if not pkg: return await callback.answer("To'plam topilmadi.", show_alert=True)
     uc_amount, uzs_price, usd_price = pkg
 
     if action == "eu_delete":
-        db_query("DELETE FROM uc_packages WHERE id = ?", (pid,), commit=True)
+        await db_query("DELETE FROM uc_packages WHERE id = ?", (pid,), commit=True)
+        uc_packages.invalidate()
         await callback.answer(f"UC To'plami (ID: {pid}) o'chirildi.", show_alert=True)
         await adm_manage_uc(callback) 
         return
@@ -1258,7 +3107,8 @@ async def adm_save_uc_amount(message: types.Message, state: FSMContext):
     try: val = int(message.text)
     except: return await message.answer("⚠️ Iltimos, butun son kiriting.")
     data = await state.get_data()
-    db_query("UPDATE uc_packages SET uc_amount = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    await db_query("UPDATE uc_packages SET uc_amount = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    uc_packages.invalidate()
     await message.answer("✅ UC miqdori tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1268,7 +3118,8 @@ async def adm_save_uc_uzs(message: types.Message, state: FSMContext):
     try: val = float(message.text)
     except: return await message.answer("⚠️ Iltimos, raqam kiriting.")
     data = await state.get_data()
-    db_query("UPDATE uc_packages SET uzs_price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    await db_query("UPDATE uc_packages SET uzs_price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    uc_packages.invalidate()
     await message.answer("✅ UZS narxi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1278,7 +3129,8 @@ async def adm_save_uc_usd(message: types.Message, state: FSMContext):
     try: val = float(message.text)
     except: return await message.answer("⚠️ Iltimos, raqam kiriting.")
     data = await state.get_data()
-    db_query("UPDATE uc_packages SET usd_price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    await db_query("UPDATE uc_packages SET usd_price = ? WHERE id = ?", (val, data['edit_pid']), commit=True)
+    uc_packages.invalidate()
     await message.answer("✅ USD narxi tahrirlandi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
@@ -1288,10 +3140,15 @@ async def adm_save_uc_usd(message: types.Message, state: FSMContext):
 @dp.callback_query(F.data == "adm_prices")
 async def adm_prices_list(callback: types.CallbackQuery):
     if callback.from_user.id != ADMIN_ID: return
+    await callback.message.edit_text("⚙️ **Narxlarni sozlash:**", reply_markup=screens.get("adm_prices", (config.version,), _build_prices_kb))
+
+def _build_prices_kb():
     p = get_dynamic_prices()
     kb = [
         [InlineKeyboardButton(text=f"Ref Bonus ({p['ref_reward']})", callback_data="set_ref_reward"),
          InlineKeyboardButton(text=f"Click ({p['click_reward']})", callback_data="set_click_reward")],
+        [InlineKeyboardButton(text=f"Ref 2-daraja ({p['ref_reward_2']})", callback_data="set_ref_reward_2"),
+         InlineKeyboardButton(text=f"Ref 3-daraja ({p['ref_reward_3']})", callback_data="set_ref_reward_3")],
         [InlineKeyboardButton(text=f"Silver ({p['pro_price']})", callback_data="set_status_price_1"),
          InlineKeyboardButton(text=f"Gold ({p['prem_price']})", callback_data="set_status_price_2")],
         [InlineKeyboardButton(text=f"Platinum ({p['king_price']})", callback_data="set_status_price_3"),
@@ -1299,7 +3156,7 @@ async def adm_prices_list(callback: types.CallbackQuery):
         [InlineKeyboardButton(text=f"Sell Comm ({p['proj_sell_commission']})", callback_data="set_proj_sell_commission")], # Sotuv komissiyasi
         [InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")]
     ]
-    await callback.message.edit_text("⚙️ **Narxlarni sozlash:**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb))
+    return InlineKeyboardMarkup(inline_keyboard=kb)
 
 @dp.callback_query(F.data.startswith("set_"))
 async def adm_set_val(callback: types.CallbackQuery, state: FSMContext):
@@ -1315,12 +3172,43 @@ async def adm_save_val(message: types.Message, state: FSMContext):
     try:
         val = float(message.text)
         data = await state.get_data()
-        set_config(data['conf_key'], val)
+        await set_config(data['conf_key'], val)
         await message.answer("✅ Saqlandi!", reply_markup=main_menu(message.from_user.id))
         await state.clear()
     except:
         await message.answer("⚠️ Iltimos, raqam yozing.")
 
+# --- MATNLARNI TAHRIRLASH ---
+
+@dp.callback_query(F.data == "adm_texts")
+async def adm_texts_list(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID: return
+    keys = sorted(set(texts.defaults) | {k[len("text_"):] for k in config._values if k.startswith("text_")})
+    kb = [[InlineKeyboardButton(text=f"📝 {key}", callback_data=f"edit_text:{key}")] for key in keys]
+    kb.append([InlineKeyboardButton(text="⬅️ Ortga", callback_data="adm_back_main")])
+    await callback.message.edit_text("📝 **Tahrirlash uchun matnni tanlang:**\n\n"
+                                     "ℹ️ Matnda `{full_name}` kabi joylardan foydalanish mumkin.",
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=kb), parse_mode="Markdown")
+
+@dp.callback_query(F.data.startswith("edit_text:"))
+async def adm_edit_text_select(callback: types.CallbackQuery, state: FSMContext):
+    if callback.from_user.id != ADMIN_ID: return
+    key = callback.data.split(":", 1)[1]
+    await state.update_data(text_key=key)
+    current = texts.get(key, texts.defaults.get(key, "")).text
+    await callback.message.answer(f"Hozirgi matn:\n\n{current}\n\nYangi matnni yuboring:", reply_markup=cancel_kb())
+    await state.set_state(AdminState.edit_text_val)
+    await callback.answer()
+
+@dp.message(AdminState.edit_text_val)
+async def adm_save_text(message: types.Message, state: FSMContext):
+    if message.from_user.id != ADMIN_ID: return
+    if not message.text: return await message.answer("⚠️ Iltimos, matn yuboring.")
+    data = await state.get_data()
+    await set_config(f"text_{data['text_key']}", message.text)
+    await message.answer("✅ Matn saqlandi!", reply_markup=main_menu(message.from_user.id))
+    await state.clear()
+
 # --- BROADCAST --- (O'zgarishsiz)
 
 @dp.callback_query(F.data == "adm_broadcast")
@@ -1329,23 +3217,282 @@ async def adm_broadcast_start(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.edit_text("📢 Barcha foydalanuvchilarga yuboriladigan xabarni (rasm/video/matn) yuboring:", reply_markup=cancel_kb())
     await state.set_state(AdminState.broadcast_msg)
 
+class TokenBucket:
+    # Telegram global limiti uchun token-bucket: sekundiga `rate` ta so'rov, `capacity` gacha portlash.
+    # RetryAfter kelganda pause() barcha jo'natuvchilarni birga to'xtatadi.
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class BroadcastManager:
+    # Broadcast ishlari: foydalanuvchilar id bo'yicha bo'laklab o'qiladi, cheklangan sondagi
+    # jo'natuvchilar parallel yuboradi, har bo'lakdan keyin progress bazaga yoziladi
+    # (restartdan keyin shu joydan davom etadi). Botni bloklaganlar is_blocked=1 bo'ladi.
+    def __init__(self, rate=25, workers=8, chunk_size=200, progress_every=3.0):
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.progress_every = progress_every
+        self._tasks = {}
+
+    async def start(self, from_chat_id, message_id, progress_chat_id):
+        total = (await db_query("SELECT COUNT(*) FROM users WHERE is_blocked = 0", fetchone=True))[0]
+        progress = await bot.send_message(progress_chat_id, f"⏳ Xabar {total} ta foydalanuvchiga yuborilmoqda...")
+        job_id = (await db_query("INSERT INTO broadcasts (from_chat_id, message_id, total, progress_chat_id, progress_message_id) "
+                                 "VALUES (?, ?, ?, ?, ?) RETURNING id",
+                                 (from_chat_id, message_id, total, progress_chat_id, progress.message_id),
+                                 fetchone=True, commit=True))[0]
+        self._spawn(job_id)
+        return job_id
+
+    async def resume(self):
+        rows = await db_query("SELECT id FROM broadcasts WHERE status = 'running'", fetchall=True) or []
+        for (job_id,) in rows:
+            logging.info(f"Broadcast #{job_id} davom ettirilmoqda")
+            self._spawn(job_id)
+
+    async def stop(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def _spawn(self, job_id):
+        if job_id in self._tasks: return
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _send(self, user_id, from_chat_id, message_id):
+        for _ in range(3):
+            await self.bucket.acquire()
+            try:
+                await bot.copy_message(user_id, from_chat_id, message_id)
+                return "sent"
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except Exception as e:
+                logging.warning(f"Broadcast {user_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def _report(self, job, done=False):
+        head = "✅ Broadcast yakunlandi" if done else "⏳ Broadcast davom etmoqda"
+        text = (f"{head} (#{job['id']})\n\n"
+                f"📤 Yuborildi: {job['sent']} / {job['total']}\n"
+                f"🚫 Bloklagan: {job['blocked']}\n"
+                f"⚠️ Xatolik: {job['failed']}")
+        try:
+            await bot.edit_message_text(text, chat_id=job['progress_chat_id'], message_id=job['progress_message_id'])
+        except Exception: pass
+
+    async def _run(self, job_id):
+        row = await db_query("SELECT from_chat_id, message_id, last_user_id, total, sent, failed, blocked, "
+                             "progress_chat_id, progress_message_id FROM broadcasts WHERE id = ?", (job_id,), fetchone=True)
+        if not row: return
+        keys = ("from_chat_id", "message_id", "last_user_id", "total", "sent", "failed", "blocked",
+                "progress_chat_id", "progress_message_id")
+        job = dict(zip(keys, row), id=job_id)
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        blocked_ids = []
+
+        async def worker():
+            while True:
+                user_id = await queue.get()
+                try:
+                    result = await self._send(user_id, job['from_chat_id'], job['message_id'])
+                    job[result] += 1
+                    if result == "blocked": blocked_ids.append((user_id,))
+                finally:
+                    queue.task_done()
+
+        senders = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        last_report = 0.0
+        try:
+            while True:
+                rows = await db_query("SELECT id FROM users WHERE id > ? AND is_blocked = 0 ORDER BY id LIMIT ?",
+                                      (job['last_user_id'], self.chunk_size), fetchall=True)
+                if not rows: break
+                for (user_id,) in rows:
+                    await queue.put(user_id)
+                await queue.join()
+
+                job['last_user_id'] = rows[-1][0]
+                if blocked_ids:
+                    await db.executemany("UPDATE users SET is_blocked = 1 WHERE id = ?", blocked_ids)
+                    blocked_ids.clear()
+                await db_query("UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?",
+                               (job['last_user_id'], job['sent'], job['failed'], job['blocked'], job_id), commit=True)
+                if time.monotonic() - last_report >= self.progress_every:
+                    last_report = time.monotonic()
+                    await self._report(job)
+
+            await db_query("UPDATE broadcasts SET status = 'done' WHERE id = ?", (job_id,), commit=True)
+            await self._report(job, done=True)
+        finally:
+            for task in senders: task.cancel()
+
+broadcasts = BroadcastManager(rate=float(os.getenv("BROADCAST_RATE", "25")),
+                              workers=int(os.getenv("BROADCAST_WORKERS", "8")))
+
 @dp.message(AdminState.broadcast_msg)
 async def adm_broadcast_send(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID: return
-    users = db_query("SELECT id FROM users", fetchall=True)
-    count = 0
-    await message.answer(f"⏳ Xabar {len(users)} ta foydalanuvchiga yuborilmoqda...")
-    
-    for user_row in users:
-        try:
-            await message.copy_to(chat_id=user_row[0])
-            count += 1
-            await asyncio.sleep(0.05) 
-        except: pass
-        
-    await message.answer(f"✅ Xabar {count} ta foydalanuvchiga yetib bordi.", reply_markup=main_menu(message.from_user.id))
+    # Yuborish fonda ishlaydi, admin FSM darhol bo'shatiladi
+    await broadcasts.start(message.chat.id, message.message_id, message.chat.id)
+    await message.answer("📢 Broadcast boshlandi. Jarayon yuqoridagi xabarda ko'rsatiladi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
+# --- XABARLAR NAVBATI (OUTBOX) ---
+# Uchinchi shaxsga yuboriladigan xabarlar (referal bonusi, sotuvchi, to'lov natijasi...) handlerda
+# bazaga yoziladi va handler darhol qaytadi. Fon jarayoni navbatni o'qiydi, bitta odamga yig'ilgan
+# xabarlarni bitta xabarga birlashtiradi va broadcast bilan umumiy token-bucket orqali yuboradi.
+# RetryAfter - bucket to'xtatiladi va xabar keyinroq qayta yuboriladi; boshqa xatoliklar eksponensial
+# kechikish bilan `max_attempts` marta takrorlanadi, keyin 'dead' bo'lib qoladi. Botni bloklagan
+# foydalanuvchi xabari darhol 'dead'.
+MESSAGE_LIMIT = 4096
+
+def _tx_enqueue(conn, items):
+    now = time.time()
+    conn.executemany("INSERT INTO notifications (chat_id, text, parse_mode, next_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                     [(chat_id, text, parse_mode, now, int(now)) for chat_id, text, parse_mode in items])
+
+def _tx_settle_notifications(conn, sent, deferred, retry, dead):
+    if sent: conn.executemany("DELETE FROM notifications WHERE id = ?", [(nid,) for nid in sent])
+    # RetryAfter urinish hisoblanmaydi - faqat vaqti suriladi
+    if deferred: conn.executemany("UPDATE notifications SET next_at = ?, last_error = ? WHERE id = ?", deferred)
+    if retry: conn.executemany("UPDATE notifications SET attempts = attempts + 1, next_at = ?, last_error = ? WHERE id = ?", retry)
+    if dead: conn.executemany("UPDATE notifications SET state = 'dead', attempts = attempts + 1, last_error = ? WHERE id = ?", dead)
+
+class Outbox:
+    def __init__(self, bucket, workers=4, batch_size=200, poll_interval=2.0, max_attempts=5):
+        self.bucket = bucket
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def enqueue(self, chat_id, text, parse_mode=None):
+        await self.enqueue_many([(chat_id, text, parse_mode)])
+
+    async def enqueue_many(self, items):
+        items = list(items)
+        if not items: return
+        await db.transaction(_tx_enqueue, items)
+        metrics.inc("bot_outbox_enqueued_total", len(items))
+        self.wake()
+
+    def wake(self):
+        # Boshqa tranzaksiya ichida (_tx_enqueue) yozilgan xabarlar uchun ham chaqiriladi
+        self._wakeup.set()
+
+    @staticmethod
+    def _merge(rows):
+        # Bir chatga ketadigan ketma-ket xabarlar (bir xil parse_mode) limitgacha bitta xabarga jamlanadi
+        groups = {}
+        for nid, chat_id, text, parse_mode, attempts in rows:
+            bucket = groups.setdefault((chat_id, parse_mode), [])
+            if bucket and len(bucket[-1][1]) + len(text) + 2 <= MESSAGE_LIMIT:
+                ids, merged, tries = bucket[-1]
+                bucket[-1] = (ids + [nid], merged + "\n\n" + text, max(tries, attempts))
+            else:
+                bucket.append(([nid], text, attempts))
+        return [(chat_id, parse_mode, ids, text, attempts)
+                for (chat_id, parse_mode), parts in groups.items() for ids, text, attempts in parts]
+
+    async def _deliver(self, chat_id, parse_mode, ids, text, attempts, outcome):
+        await self.bucket.acquire()
+        try:
+            await bot.send_message(chat_id, text, parse_mode=parse_mode)
+            outcome["sent"] += ids
+            metrics.inc("bot_outbox_total", len(ids), result="sent")
+        except TelegramRetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            outcome["deferred"] += [(time.time() + e.retry_after, "RetryAfter", nid) for nid in ids]
+            metrics.inc("bot_outbox_total", len(ids), result="deferred")
+        except TelegramForbiddenError as e:
+            outcome["dead"] += [(str(e), nid) for nid in ids]
+            metrics.inc("bot_outbox_total", len(ids), result="dead")
+        except Exception as e:
+            if attempts + 1 >= self.max_attempts:
+                outcome["dead"] += [(str(e), nid) for nid in ids]
+                metrics.inc("bot_outbox_total", len(ids), result="dead")
+            else:
+                delay = min(3600, 5 * 2 ** attempts)
+                outcome["retry"] += [(time.time() + delay, str(e), nid) for nid in ids]
+                metrics.inc("bot_outbox_total", len(ids), result="retry")
+
+    async def drain_once(self):
+        # Vaqti kelgan bir to'plamni yuboradi, yuborilgan xabarlar sonini qaytaradi
+        rows = await db_query("SELECT id, chat_id, text, parse_mode, attempts FROM notifications "
+                              "WHERE state = 'pending' AND next_at <= ? ORDER BY next_at, id LIMIT ?",
+                              (time.time(), self.batch_size), fetchall=True) or []
+        if not rows: return 0
+        queue = asyncio.Queue()
+        for message in self._merge(rows): queue.put_nowait(message)
+        outcome = {"sent": [], "deferred": [], "retry": [], "dead": []}
+
+        async def worker():
+            while not queue.empty():
+                await self._deliver(*queue.get_nowait(), outcome)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, queue.qsize()))))
+        await db.transaction(_tx_settle_notifications, outcome["sent"], outcome["deferred"], outcome["retry"], outcome["dead"])
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            try:
+                if await self.drain_once() >= self.batch_size: continue # Navbatda yana bor
+            except Exception as e:
+                logging.error(f"Outbox xatolik: {e}")
+            self._wakeup.clear()
+            try: await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError: pass
+
+    async def stats(self):
+        rows = await db_query("SELECT state, COUNT(*) FROM notifications GROUP BY state", fetchall=True) or []
+        return dict(rows)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Yuborilmay qolganlar bazada qoladi va keyingi ishga tushishda yuboriladi
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+outbox = Outbox(broadcasts.bucket, workers=int(os.getenv("OUTBOX_WORKERS", "4")),
+                max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")))
+
 # --- HISOB TO'LDIRISH --- (O'zgarishsiz)
 
 @dp.message(F.text == "💳 Hisobni to'ldirish")
@@ -1394,51 +3541,177 @@ async def topup_amt(message: types.Message, state: FSMContext):
     await message.answer(f"💵 To'lov miqdori: **{txt}**\n\nTo'lovni amalga oshirib, chekni (skrinshot) shu yerga yuboring:", parse_mode="Markdown")
     await state.set_state(FillBalance.waiting_for_receipt)
 
-@dp.message(FillBalance.waiting_for_receipt, F.photo)
+@dp.message(FillBalance.waiting_for_receipt, F.photo, flags={"throttle": "purchase"})
 async def topup_rec(message: types.Message, state: FSMContext):
     data = await state.get_data()
+    order_id = await orders.create("topup", message.from_user.id, data['amt'], {"txt": data['txt'], "curr": data['curr']})
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Tasdiqlash", callback_data=f"p_ok:{message.from_user.id}:{data['amt']}"),
-         InlineKeyboardButton(text="❌ Rad etish", callback_data=f"p_no:{message.from_user.id}")]
+        [InlineKeyboardButton(text="✅ Tasdiqlash", callback_data=f"ord:ok:{order_id}"),
+         InlineKeyboardButton(text="❌ Rad etish", callback_data=f"ord:no:{order_id}")]
     ])
     
     # Adminga yuborish
-    caption = (f"📥 **YANGI TO'LOV!**\n\n"
+    caption = (f"📥 **YANGI TO'LOV!** (#{order_id})\n\n"
                f"👤 User: `{message.from_user.id}`\n"
                f"💎 So'raldi: {data['amt']} {CURRENCY_SYMBOL}\n"
                f"💵 To'lov: {data['txt']}")
     
-    await bot.send_photo(ADMIN_ID, message.photo[-1].file_id, caption=caption, reply_markup=kb, parse_mode="Markdown")
+    await orders.attach(order_id, await bot.send_photo(ADMIN_ID, message.photo[-1].file_id, caption=caption, reply_markup=kb, parse_mode="Markdown"))
     
     await message.answer("✅ Chek qabul qilindi! Admin tasdiqlagach hisobingiz to'ldiriladi.", reply_markup=main_menu(message.from_user.id))
     await state.clear()
 
-@dp.callback_query(F.data.startswith("p_ok:"))
-async def approve_pay(callback: types.CallbackQuery):
-    if callback.from_user.id != ADMIN_ID: return
-    parts = callback.data.split(":")
-    uid, amt = int(parts[1]), float(parts[2])
-    db_query("UPDATE users SET balance = balance + ? WHERE id = ?", (amt, uid), commit=True)
-    try:
-        await bot.send_message(uid, f"✅ **To'lov tasdiqlandi!**\nHisobingizga +{format_num(amt)} {CURRENCY_SYMBOL} qo'shildi.")
-    except: pass
-    await callback.message.edit_caption(caption=callback.message.caption + "\n\n✅ TASDIQLANDI")
-
-@dp.callback_query(F.data.startswith("p_no:"))
-async def reject_pay(callback: types.CallbackQuery):
-    if callback.from_user.id != ADMIN_ID: return
-    uid = int(callback.data.split(":")[1])
-    try:
-        await bot.send_message(uid, "❌ To'lovingiz rad etildi. Iltimos, admin bilan bog'laning.")
-    except: pass
-    await callback.message.edit_caption(caption=callback.message.caption + "\n\n❌ RAD ETILDI")
-
 
 # --- BOTNI ISHGA TUSHIRISH ---
 
+async def warm_up():
+    # Polling boshlanishidan oldin keshlarni to'ldirish, har bosqich vaqti logga yoziladi
+    steps = (("config", config.load), ("bot", bot.me), ("uc_packages", uc_packages.get),
+             ("catalog", lambda: catalog.render("user", "a", "n", 0)), ("leaderboard", leaderboard.load))
+    for name, step in steps:
+        started = time.perf_counter()
+        await step()
+        logging.info(f"Warm-up: {name} {(time.perf_counter() - started) * 1000:.1f} ms")
+
+metrics_runner = None
+
+async def on_startup(background_jobs=True, metrics_port=METRICS_PORT):
+    global metrics_runner
+    await warm_up()
+    await cache_sync.start()
+    if metrics_port:
+        metrics_runner = await start_metrics_server(metrics_port)
+    clicks.start()
+    fsm_storage.start()
+    # Fon ishlari (broadcast, status tekshiruvi) faqat bitta jarayonda ishlaydi
+    if background_jobs:
+        await broadcasts.resume()
+        statuses.start()
+        outbox.start()
+
+async def on_shutdown():
+    if metrics_runner: await metrics_runner.cleanup()
+    await statuses.stop()
+    await orders.stop()
+    await exporter.stop()
+    await outbox.stop()
+    await cache_sync.stop()
+    await broadcasts.stop()
+    await clicks.stop()
+    await fsm_storage.close()
+    db.close()
+
 async def main():
     print(f"Bot ishga tushdi... {CURRENCY_NAME}")
-    await dp.start_polling(bot)
+    await on_startup()
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
+
+# --- WEBHOOK REJIMI ---
+# BOT_MODE=webhook bo'lsa polling o'rniga aiohttp server ishlaydi. Heroku da bu `web` dyno talab qiladi:
+#   web: BOT_MODE=webhook python Pubg.py
+# WEB_WORKERS > 1 bo'lsa bir portda SO_REUSEPORT orqali bir nechta jarayon ishga tushadi. Har bir
+# jarayonning xotiradagi keshlari alohida - admin tahrirlari CacheSync orqali boshqa jarayonlarga
+# yetkaziladi, FSM keshsiz ishlaydi, reyting esa TTL bilan qayta o'qiladi.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))
+
+class WebhookHandler:
+    # Secret token tekshiriladi, update darhol 200 bilan qabul qilinadi va fonda dispatcherga
+    # beriladi. Bir vaqtda ishlanayotgan updatelar soni `concurrency` bilan cheklanadi: limit
+    # to'lsa javob kechikadi va Telegram yuborishni sekinlashtiradi.
+    def __init__(self, secret="", concurrency=64):
+        self.secret = secret
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks = set()
+
+    async def handle(self, request):
+        if self.secret and not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), self.secret):
+            return web.Response(status=401)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception:
+            return web.Response(status=400)
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            logging.error(f"Update {update.update_id} xatolik: {e}")
+        finally:
+            self._slots.release()
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+async def set_webhook():
+    await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                          allowed_updates=dp.resolve_used_update_types())
+
+def reuseport_socket(host, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+async def run_webhook(worker_index=0, sock=None):
+    print(f"Webhook server ishga tushdi (worker {worker_index})... {CURRENCY_NAME}")
+    # Har bir worker o'z metrikalarini METRICS_PORT + worker_index portida beradi
+    await on_startup(background_jobs=worker_index == 0,
+                     metrics_port=METRICS_PORT + worker_index if METRICS_PORT else 0)
+    handler = WebhookHandler(WEBHOOK_SECRET, WEBHOOK_CONCURRENCY)
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handler.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.SockSite(runner, sock) if sock else web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    # Webhook faqat bitta worker tomonidan, o'z event loopida (bot sessiyasi loopga bog'langan)
+    if WEBHOOK_URL and worker_index == 0: await set_webhook()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await handler.drain()
+        await on_shutdown()
+        await bot.session.close()
+
+def run_webhook_worker(worker_index):
+    asyncio.run(run_webhook(worker_index, reuseport_socket(WEBAPP_HOST, WEBAPP_PORT)))
+
+def main_webhook():
+    if WEB_WORKERS <= 1:
+        return asyncio.run(run_webhook())
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_webhook_worker, args=(idx,)) for idx in range(WEB_WORKERS)]
+    for proc in workers: proc.start()
+    try:
+        for proc in workers: proc.join()
+    except KeyboardInterrupt:
+        for proc in workers: proc.join()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        main_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,263 @@
+# Dispatcher hot-pathlari uchun oflayn benchmark.
+# Sintetik Update lar dp.feed_update orqali o'tkaziladi, Bot sessiyasi HTTP so'rov yubormaydi (faqat yozib oladi),
+# baza vaqtinchalik papkada N ta foydalanuvchi va M ta akkount bilan to'ldiriladi. Haqiqiy bazaga tegmaydi.
+#
+#   python bench.py                                  # barcha ssenariylar
+#   python bench.py -s clicker -s catalog --users 20000
+#   python bench.py --json natija.json               # natijani saqlash
+#   python bench.py --baseline natija.json           # oldingi natijadan sekinlashsa exit code 1
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import datetime
+import tempfile
+import itertools
+
+# Pubg import qilinishidan oldin: vaqtinchalik baza va test token
+BENCH_DIR = tempfile.mkdtemp(prefix="pubg-bench-")
+os.environ["DB_NAME"] = os.path.join(BENCH_DIR, "bench.db")
+os.environ.setdefault("BOT_TOKEN", "123456:BENCH")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("BROADCAST_RATE", "1000000") # Telegram limiti emas, bot kodi o'lchanadi
+os.environ.setdefault("METRICS_PORT", "0")
+
+import logging
+logging.disable(logging.INFO)
+
+import Pubg
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, CallbackQuery, Chat, User, MessageId
+
+ADMIN_ID = Pubg.ADMIN_ID
+FIRST_USER_ID = 10_000
+BOT_USER = User(id=42, is_bot=True, first_name="Bench", username="bench_bot")
+
+class RecordingSession(BaseSession):
+    # Bot API o'rniga: har bir metod sanaladi va turiga mos soxta javob qaytariladi
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency: await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        if returning is User: return BOT_USER
+        if returning is MessageId: return MessageId(message_id=next(self._message_ids))
+        if "Message" in str(returning):
+            chat_id = getattr(method, "chat_id", None) or 1
+            return Message(message_id=next(self._message_ids), date=datetime.datetime.now(),
+                           chat=Chat(id=int(chat_id), type="private"), text=getattr(method, "text", None))
+        return True
+
+    async def close(self): pass
+
+    async def stream_content(self, *args, **kwargs):
+        if False: yield b""
+
+class Updates:
+    # Sintetik Update yasovchi
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, user_id, text, **kwargs):
+        return Update(update_id=next(self._update_ids), message=Message(
+            message_id=next(self._message_ids), date=datetime.datetime.now(), chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"), text=text, **kwargs))
+
+    def callback(self, user_id, data):
+        origin = Message(message_id=next(self._message_ids), date=datetime.datetime.now(),
+                         chat=Chat(id=user_id, type="private"), from_user=BOT_USER, text="...")
+        return Update(update_id=next(self._update_ids), callback_query=CallbackQuery(
+            id=str(next(self._message_ids)), chat_instance="bench", data=data, message=origin,
+            from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}")))
+
+def seed(path, users, projects):
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO users (id, balance, status_level) VALUES (?, ?, ?)",
+                         ((FIRST_USER_ID + idx, 1_000_000.0, random.choice((0, 0, 0, 1, 2))) for idx in range(users)))
+        conn.execute("INSERT OR IGNORE INTO users (id, balance) VALUES (?, 0)", (ADMIN_ID,))
+        conn.executemany("INSERT INTO projects (name, price, description, file_id, seller_id, is_approved) VALUES (?, ?, ?, ?, ?, 1)",
+                         ((f"Akkount {idx}", random.randint(1, 500), f"Tavsif {idx}", f"FILE{idx}",
+                           FIRST_USER_ID + random.randrange(users) if idx % 3 else None) for idx in range(projects)))
+
+# --- SSENARIYLAR ---
+# Har bir ssenariy sessiyalar ro'yxatini qaytaradi: bitta sessiya - bitta foydalanuvchining ketma-ket
+# updatelari (FSM oqimlari tartibi buzilmasligi uchun). Sessiyalar parallel ishlaydi.
+
+class Scenarios:
+    def __init__(self, users, projects, size):
+        self.users = users
+        self.projects = projects
+        self.size = size
+        self.make = Updates()
+        self._new_users = itertools.count(FIRST_USER_ID + users)
+        # Anti-spam bucketlari to'lib qolmasligi uchun har ssenariy boshqa foydalanuvchilarni oladi
+        self._pool = itertools.cycle(range(FIRST_USER_ID, FIRST_USER_ID + users))
+
+    def user(self):
+        return next(self._pool)
+
+    def project(self):
+        return random.randint(1, self.projects)
+
+    def start_referral(self):
+        return [[self.make.message(next(self._new_users), f"/start {self.user()}")] for _ in range(self.size)]
+
+    def clicker(self):
+        taps = 10
+        return [[self.make.callback(uid, "clicker_process") for _ in range(taps)]
+                for uid in (self.user() for _ in range(max(1, self.size // taps)))]
+
+    def kabinet(self):
+        return [[self.make.message(self.user(), "👤 Kabinet")] for _ in range(self.size)]
+
+    def catalog(self):
+        sessions = []
+        for _ in range(max(1, self.size // 4)):
+            uid = self.user()
+            sessions.append([self.make.message(uid, "📂 Akkountlar"),
+                             self.make.callback(uid, f"cat:a:n:{self.project()}"),
+                             self.make.callback(uid, f"cat:a:p:{self.project()}"),
+                             self.make.callback(uid, f"view_proj_{self.project()}")])
+        return sessions
+
+    def purchases(self):
+        sessions = []
+        for _ in range(max(1, self.size // 2)):
+            uid, pid = self.user(), self.project()
+            sessions.append([self.make.callback(uid, f"view_proj_{pid}"), self.make.callback(uid, f"buy_proj_{pid}")])
+        return sessions
+
+    def transfers(self):
+        sessions = []
+        for _ in range(max(1, self.size // 3)):
+            uid, rid = self.user(), self.user()
+            sessions.append([self.make.callback(uid, "transfer_start"),
+                             self.make.message(uid, str(rid)),
+                             self.make.message(uid, "1")])
+        return sessions
+
+    def broadcast(self):
+        # Admin holati (AdminState.broadcast_msg) bench() da oldindan o'rnatiladi
+        return [[self.make.message(ADMIN_ID, "📢 Benchmark xabari")]]
+
+SCENARIOS = ("start_referral", "clicker", "kabinet", "catalog", "purchases", "transfers", "broadcast")
+
+def percentile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def run_sessions(sessions, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for session in sessions: queue.put_nowait(session)
+
+    async def worker():
+        while not queue.empty():
+            for update in queue.get_nowait():
+                started = time.perf_counter()
+                await Pubg.dp.feed_update(Pubg.bot, update)
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+async def wait_broadcasts():
+    # Broadcast fonda ishlaydi: yuborishlar tugaguncha kutiladi
+    while Pubg.broadcasts._tasks:
+        await asyncio.gather(*Pubg.broadcasts._tasks.values(), return_exceptions=True)
+
+async def bench(args):
+    seed(os.environ["DB_NAME"], args.users, args.projects)
+    session = RecordingSession(latency=args.api_latency / 1000)
+    session.middleware(Pubg.ApiMetricsMiddleware())
+    Pubg.bot.session = session
+    await Pubg.on_startup(background_jobs=False, metrics_port=0)
+
+    scenarios = Scenarios(args.users, args.projects, args.updates)
+    results = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            sessions = getattr(scenarios, name)()
+            if name == "broadcast":
+                await Pubg.dp.fsm.get_context(Pubg.bot, ADMIN_ID, ADMIN_ID).set_state(Pubg.AdminState.broadcast_msg)
+            calls_before = sum(session.calls.values())
+            latencies, elapsed = await run_sessions(sessions, args.concurrency)
+            extra = {}
+            if name == "broadcast":
+                started = time.perf_counter()
+                sent_before = session.calls.get("CopyMessage", 0)
+                await wait_broadcasts()
+                delivery = time.perf_counter() - started
+                sent = session.calls.get("CopyMessage", 0) - sent_before
+                extra = {"delivered": sent, "delivered_per_sec": round(sent / delivery, 1) if delivery else 0.0}
+            latencies.sort()
+            results[name] = dict(updates=len(latencies), seconds=round(elapsed, 4),
+                                 updates_per_sec=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                                 p50_ms=round(percentile(latencies, 0.50) * 1000, 3),
+                                 p99_ms=round(percentile(latencies, 0.99) * 1000, 3),
+                                 api_calls=sum(session.calls.values()) - calls_before, **extra)
+    finally:
+        await Pubg.on_shutdown()
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+    return results
+
+def report(results):
+    print(f"\n{'ssenariy':<16}{'update':>8}{'upd/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'API':>8}")
+    for name, row in results.items():
+        print(f"{name:<16}{row['updates']:>8}{row['updates_per_sec']:>11}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['api_calls']:>8}")
+        if "delivered" in row:
+            print(f"{'':<16}broadcast: {row['delivered']} ta xabar, {row['delivered_per_sec']} xabar/s")
+
+def compare(results, baseline, tolerance):
+    # Throughput `tolerance` ulushdan ko'proq tushsa yoki p99 shuncha oshsa - regressiya
+    regressions = []
+    for name, row in results.items():
+        old = baseline.get(name)
+        if not old: continue
+        if row['updates_per_sec'] < old['updates_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: upd/s {old['updates_per_sec']} -> {row['updates_per_sec']}")
+        if row['p99_ms'] > old['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {old['p99_ms']}ms -> {row['p99_ms']}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Pubg bot dispatcher benchmark (oflayn)")
+    parser.add_argument("-s", "--scenario", action="append", choices=SCENARIOS, help="faqat shu ssenariy(lar)")
+    parser.add_argument("--users", type=int, default=5000, help="bazadagi foydalanuvchilar soni (N)")
+    parser.add_argument("--projects", type=int, default=500, help="bazadagi akkountlar soni (M)")
+    parser.add_argument("--updates", type=int, default=2000, help="har ssenariydagi taxminiy update soni")
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel sessiyalar")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="soxta Bot API kechikishi (ms)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="natijani JSON faylga yozish")
+    parser.add_argument("--baseline", help="oldingi --json natijasi bilan solishtirish")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="ruxsat etilgan sekinlashish ulushi")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    results = asyncio.run(bench(args))
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions: print(f"⚠️ Regressiya: {line}")
+        if regressions: sys.exit(1)
+
+if __name__ == "__main__":
+    main()
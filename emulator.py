@@ -0,0 +1,370 @@
+# Lokal Telegram Bot API emulyatori va yuklama generatori.
+# Polling, webhook, broadcast va RetryAfter ishlovini Telegramga tegmasdan sinash uchun.
+#
+#   python emulator.py serve --port 8081 --latency 20 --jitter 10 --global-rate 30 --chat-rate 1 --error-rate 0.01
+#   TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:TEST ADMIN_ID=1 python Pubg.py
+#   python emulator.py drive --api http://127.0.0.1:8081 --users 5000 --rate 300 --duration 60
+#
+# Webhook rejimi: Pubg BOT_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8080 bilan ishga tushsa setWebhook
+# emulyatorga keladi va updatelar o'sha manzilga POST qilinadi (secret token sarlavhasi bilan).
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import deque, Counter
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 777000, "is_bot": True, "first_name": "Emulator", "username": "emulator_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": True}
+
+class RateLimit:
+    # Bloklamaydigan token-bucket: token bo'lmasa nechchi sekund kutish kerakligini qaytaradi
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return max(1, math.ceil((1 - self.tokens) / self.rate))
+
+class TelegramError(Exception):
+    def __init__(self, code, description, retry_after=None):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+class Emulator:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, blocked_rate=0.0,
+                 global_rate=0.0, chat_rate=0.0, max_connections=40):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.blocked_rate = blocked_rate
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.max_connections = max_connections
+        self._global = RateLimit(global_rate) if global_rate else None
+        self._chats = {}
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self.updates = deque()       # getUpdates navbati
+        self._new_updates = asyncio.Event()
+        self.webhook = None          # {"url", "secret_token"}
+        self._webhook_tasks = []
+        # Javob kechikishi: update kiritilgan vaqtdan bot shu chatga birinchi javob berguncha
+        self._waiting = {}
+        self._callbacks = {}         # callback_query id -> foydalanuvchi
+        self.response_times = []
+        self.calls = Counter()
+        self.rejected = Counter()
+        self.injected = 0
+        self.delivered = 0
+
+    # --- Sozlamalar / statistika (driver uchun) ---
+    def configure(self, **options):
+        for key in ("latency", "jitter", "error_rate", "blocked_rate", "global_rate", "chat_rate"):
+            if key in options: setattr(self, key, float(options[key]))
+        self._global = RateLimit(self.global_rate) if self.global_rate else None
+        self._chats.clear()
+
+    def stats(self):
+        times = sorted(self.response_times)
+        pick = lambda q: round(times[min(len(times) - 1, int(q * len(times)))] * 1000, 1) if times else None
+        return {"injected": self.injected, "delivered": self.delivered, "queued": len(self.updates),
+                "awaiting_reply": sum(len(q) for q in self._waiting.values()),
+                "calls": dict(self.calls), "rejected": dict(self.rejected),
+                "replies": len(times), "reply_p50_ms": pick(0.5), "reply_p99_ms": pick(0.99)}
+
+    # --- Updatelar ---
+    def inject(self, update):
+        update = dict(update, update_id=next(self._update_ids))
+        chat_id = self._update_chat(update)
+        if chat_id is not None:
+            self._waiting.setdefault(chat_id, deque()).append(time.monotonic())
+        if "callback_query" in update:
+            self._callbacks[update["callback_query"]["id"]] = chat_id
+        self.updates.append(update)
+        self.injected += 1
+        self._new_updates.set()
+
+    @staticmethod
+    def _update_chat(update):
+        if "message" in update: return update["message"]["chat"]["id"]
+        if "callback_query" in update: return update["callback_query"]["from"]["id"]
+        return None
+
+    def _replied(self, chat_id):
+        waiting = self._waiting.get(chat_id)
+        if waiting:
+            self.response_times.append(time.monotonic() - waiting.popleft())
+            if not waiting: del self._waiting[chat_id]
+
+    async def get_updates(self, offset=0, limit=100, timeout=0):
+        if self.webhook:
+            raise TelegramError(409, "Conflict: can't use getUpdates method while webhook is active; use deleteWebhook to delete the webhook first")
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft() # tasdiqlangan updatelar
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = list(itertools.islice(self.updates, limit))
+        self.delivered += len(batch)
+        return batch
+
+    # --- Webhook ---
+    def set_webhook(self, url, secret_token=None):
+        self.delete_webhook()
+        self.webhook = {"url": url, "secret_token": secret_token}
+        self._webhook_tasks = [asyncio.create_task(self._push()) for _ in range(self.max_connections)]
+
+    def delete_webhook(self):
+        for task in self._webhook_tasks: task.cancel()
+        self._webhook_tasks = []
+        self.webhook = None
+
+    async def _push(self):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook["secret_token"]} if self.webhook["secret_token"] else {}
+        async with aiohttp.ClientSession() as session:
+            while True:
+                if not self.updates:
+                    self._new_updates.clear()
+                    await self._new_updates.wait()
+                    continue
+                update = self.updates.popleft()
+                try:
+                    async with session.post(self.webhook["url"], json=update, headers=headers) as resp:
+                        if resp.status != 200: raise aiohttp.ClientError(f"HTTP {resp.status}")
+                    self.delivered += 1
+                except aiohttp.ClientError:
+                    # Telegram kabi: muvaffaqiyatsiz update keyinroq qayta yuboriladi
+                    self.updates.appendleft(update)
+                    await asyncio.sleep(1)
+
+    # --- Bot API metodlari ---
+    def _check_limits(self, chat_id):
+        if self._global:
+            retry = self._global.take()
+            if retry: raise TelegramError(429, f"Too Many Requests: retry after {retry}", retry)
+        if self.chat_rate and chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                bucket = self._chats[chat_id] = RateLimit(self.chat_rate, capacity=self.chat_rate)
+            retry = bucket.take()
+            if retry: raise TelegramError(429, f"Too Many Requests: retry after {retry}", retry)
+        if self.blocked_rate and chat_id is not None and (int(chat_id) * 2654435761) % 1000 < self.blocked_rate * 1000:
+            raise TelegramError(403, "Forbidden: bot was blocked by the user")
+
+    def _message(self, chat_id, **fields):
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "from": BOT_USER,
+                "chat": {"id": int(chat_id), "type": "private"}, **fields}
+
+    def _file(self, value):
+        # file_id qatori o'zi qaytadi, yuklangan fayl uchun yangi id beriladi
+        if isinstance(value, str) and value:
+            return value
+        return f"EMU{next(self._file_ids)}"
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)) / 1000)
+        if method == "getMe": return BOT_USER
+        if method == "getUpdates":
+            return await self.get_updates(int(params.get("offset") or 0), int(params.get("limit") or 100),
+                                          float(params.get("timeout") or 0))
+        if method == "setWebhook":
+            self.set_webhook(params["url"], params.get("secret_token"))
+            return True
+        if method == "deleteWebhook":
+            self.delete_webhook()
+            if params.get("drop_pending_updates") in ("true", "True", True): self.updates.clear()
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook["url"] if self.webhook else "", "has_custom_certificate": False,
+                    "pending_update_count": len(self.updates)}
+        if method == "answerCallbackQuery":
+            if self.error_rate and random.random() < self.error_rate:
+                raise TelegramError(500, "Internal Server Error")
+            chat_id = self._callbacks.pop(params.get("callback_query_id"), None)
+            if chat_id is not None: self._replied(chat_id)
+            return True
+
+        chat_id = params.get("chat_id")
+        if chat_id is None:
+            raise TelegramError(400, "Bad Request: chat_id is empty")
+        self._check_limits(chat_id)
+        if self.error_rate and random.random() < self.error_rate:
+            raise TelegramError(500, "Internal Server Error")
+        self._replied(int(chat_id))
+        caption = params.get("caption")
+
+        if method == "sendMessage": return self._message(chat_id, text=params.get("text", ""))
+        if method == "copyMessage": return {"message_id": next(self._message_ids)}
+        if method == "sendPhoto":
+            file_id = self._file(params.get("photo"))
+            return self._message(chat_id, caption=caption, photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}])
+        if method == "sendVideo":
+            file_id = self._file(params.get("video"))
+            return self._message(chat_id, caption=caption, video={"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1, "duration": 1})
+        if method == "sendDocument":
+            file_id = self._file(params.get("document"))
+            return self._message(chat_id, caption=caption, document={"file_id": file_id, "file_unique_id": file_id})
+        if method == "editMessageText":
+            return dict(self._message(chat_id, text=params.get("text", "")), message_id=int(params.get("message_id") or 0))
+        if method == "editMessageCaption":
+            return dict(self._message(chat_id, caption=caption), message_id=int(params.get("message_id") or 0))
+        if method == "deleteMessage": return True
+        raise TelegramError(404, "Not Found: method not found")
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {}
+            for key, value in (await request.post()).items():
+                params[key] = value if isinstance(value, str) else None # yuklangan fayl
+        try:
+            result = await self.call(method, params)
+            return web.json_response({"ok": True, "result": result})
+        except TelegramError as e:
+            self.rejected[e.code] += 1
+            body = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.retry_after: body["parameters"] = {"retry_after": e.retry_after}
+            return web.json_response(body, status=e.code)
+
+    # --- Boshqaruv endpointlari ---
+    async def control_updates(self, request):
+        updates = await request.json()
+        for update in updates: self.inject(update)
+        return web.json_response({"ok": True, "injected": len(updates)})
+
+    async def control_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def control_config(self, request):
+        self.configure(**await request.json())
+        return web.json_response({"ok": True})
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        app.router.add_post("/_emu/updates", self.control_updates)
+        app.router.add_get("/_emu/stats", self.control_stats)
+        app.router.add_post("/_emu/config", self.control_config)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _cleanup(self, app):
+        self.delete_webhook()
+
+# --- YUKLAMA GENERATORI ---
+ACTIONS = (("👤 Kabinet", 3), ("💸 Pul ishlash", 2), ("clicker_process", 10), ("📂 Akkountlar", 2),
+           ("🏆 Top Foydalanuvchilar", 1), ("🌟 Statuslar", 1))
+
+class Driver:
+    # Minglab virtual foydalanuvchilar: har biri /start (ba'zan referal bilan) dan boshlaydi,
+    # keyin menyu tugmalari va clicker bosishlarini tasodifiy aralashmada yuboradi.
+    def __init__(self, api, users, first_user_id=100_000, referral_rate=0.3):
+        self.api = api.rstrip("/")
+        self.users = [first_user_id + idx for idx in range(users)]
+        self.referral_rate = referral_rate
+        self.started = set()
+        self._message_ids = itertools.count(1)
+        self._choices, self._weights = zip(*ACTIONS)
+
+    def _user(self, uid):
+        return {"id": uid, "is_bot": False, "first_name": f"Sim{uid}"}
+
+    def _message(self, uid, text):
+        return {"message": {"message_id": next(self._message_ids), "date": int(time.time()), "text": text,
+                            "chat": {"id": uid, "type": "private"}, "from": self._user(uid)}}
+
+    def _callback(self, uid, data):
+        origin = {"message_id": next(self._message_ids), "date": int(time.time()), "text": "...",
+                  "chat": {"id": uid, "type": "private"}, "from": BOT_USER}
+        return {"callback_query": {"id": str(next(self._message_ids)), "from": self._user(uid),
+                                   "chat_instance": "emu", "data": data, "message": origin}}
+
+    def next_update(self):
+        uid = random.choice(self.users)
+        if uid not in self.started:
+            text = "/start"
+            if self.started and random.random() < self.referral_rate:
+                text += f" {random.choice(tuple(self.started))}"
+            self.started.add(uid)
+            return self._message(uid, text)
+        action = random.choices(self._choices, self._weights)[0]
+        if action == "clicker_process": return self._callback(uid, action)
+        return self._message(uid, action)
+
+    async def run(self, rate, duration, batch=50):
+        async with aiohttp.ClientSession() as session:
+            sent, started = 0, time.monotonic()
+            while time.monotonic() - started < duration:
+                updates = [self.next_update() for _ in range(batch)]
+                async with session.post(f"{self.api}/_emu/updates", json=updates) as resp:
+                    resp.raise_for_status()
+                sent += batch
+                # Kerakli tezlikka moslash
+                ahead = sent / rate - (time.monotonic() - started)
+                if ahead > 0: await asyncio.sleep(ahead)
+            print(f"Yuborildi: {sent} update, {sent / (time.monotonic() - started):.0f} upd/s")
+            # Bot navbatni bo'shatguncha kutish
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                async with session.get(f"{self.api}/_emu/stats") as resp:
+                    stats = await resp.json()
+                if not stats["queued"] and not stats["awaiting_reply"]: break
+                await asyncio.sleep(0.5)
+            print(json.dumps(stats, indent=2, ensure_ascii=False))
+            return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokal Telegram Bot API emulyatori")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="emulyator serverini ishga tushirish")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--latency", type=float, default=0.0, help="har so'rovga qo'shiladigan kechikish (ms)")
+    serve.add_argument("--jitter", type=float, default=0.0, help="kechikish tebranishi (± ms)")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="500 xatolik ulushi")
+    serve.add_argument("--blocked-rate", type=float, default=0.0, help="botni bloklagan (403) chatlar ulushi")
+    serve.add_argument("--global-rate", type=float, default=0.0, help="sekundiga umumiy limit, masalan 30 (0 - cheksiz)")
+    serve.add_argument("--chat-rate", type=float, default=1.0, help="bitta chatga sekundiga limit (0 - cheksiz)")
+    serve.add_argument("--max-connections", type=int, default=40, help="webhookka parallel ulanishlar")
+    drive = sub.add_parser("drive", help="virtual foydalanuvchilardan updatelar yuborish")
+    drive.add_argument("--api", default="http://127.0.0.1:8081")
+    drive.add_argument("--users", type=int, default=5000)
+    drive.add_argument("--rate", type=float, default=200, help="sekundiga update")
+    drive.add_argument("--duration", type=float, default=30, help="sekund")
+    drive.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        emulator = Emulator(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                            blocked_rate=args.blocked_rate, global_rate=args.global_rate,
+                            chat_rate=args.chat_rate, max_connections=args.max_connections)
+        web.run_app(emulator.app(), host=args.host, port=args.port)
+    else:
+        random.seed(args.seed)
+        asyncio.run(Driver(args.api, args.users).run(args.rate, args.duration))
+
+if __name__ == "__main__":
+    main()